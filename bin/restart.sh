@@ -3,6 +3,6 @@
 BOT_HOME=$HOME/decision_bot
 
 cd $BOT_HOME
-echo 'Restarted bot at' `date` >> ./log.txt
+echo "{\"time\": \"`date '+%Y-%m-%d %H:%M:%S'`\", \"event\": \"restart\"}" >> ./log.jsonl
 ./bin/stop.sh
 ./bin/start-background.sh
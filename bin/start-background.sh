@@ -6,8 +6,7 @@ if ! pgrep -f 'decision_bot.py'
 then
 	cd $BOT_HOME
 	nohup python3.6 ./notify_account.py &
-	nohup python3.6 ./decision_bot.py &
-	echo 'Started bot at' `date` >> ./log.txt
-	echo '-------------' >> ./log.txt
+	nohup python3.6 ./decision_bot.py --corpus-writer &
+	echo "{\"time\": \"`date '+%Y-%m-%d %H:%M:%S'`\", \"event\": \"start\"}" >> ./log.jsonl
 	./bin/check.sh
 fi
@@ -6,5 +6,5 @@ if ! pgrep -f 'decision_bot.py'
 then
 	cd $BOT_HOME
 	echo 'Started decision bot...'
-	python3.6 ./decision_bot.py -d
+	python3.6 ./decision_bot.py -d --corpus-writer
 fi
@@ -1,29 +1,42 @@
+import os
 import sys
+import signal
+import json
+import queue
+import threading
 import traceback
 import praw
 from praw.exceptions import PRAWException
+import re
 import string
 import time
 import random
 import logging
 import yaml
 import argparse
+from collections import Counter
 from retry import retry
 from datetime import datetime
 from scipy import stats
-from typing import List, Tuple, Set, Optional, Union
+from typing import List, Tuple, Set, Optional, Union, NamedTuple
 
 import fight_finder as ff
+from structured_log import StructuredLog
 
 # Set logging level to INFO for all output, CRITICAL for minimal output
 logging.basicConfig(stream=sys.stdout, level=logging.WARNING)
 logger = logging.getLogger('DECISION_BOT')
 
 # Load configs
-with open('config.yaml', 'r') as cfg_file:
+CONFIG_FILE = 'config.yaml'
+with open(CONFIG_FILE, 'r') as cfg_file:
     cfg = yaml.load(cfg_file)
 log = cfg['log_name']
 comment_log = cfg['comment_log_name']
+# Both logs are written by background threads, off the reply path
+event_log = StructuredLog(log, max_bytes=cfg['log_max_bytes'], backup_count=cfg['log_backup_count'],
+                          flush_interval=cfg['log_flush_interval'])
+commented_log = StructuredLog(comment_log, flush_interval=cfg['log_flush_interval'])
 troubleshoot_text = cfg['troubleshoot_text']
 phrases = cfg['fail_phrases']
 PHRASE_INDEX = 0
@@ -260,6 +273,201 @@ def build_fan_scores_text(fan_scores: Optional[List[List[Union[str, int]]]]) ->
     return f"\n*{total_num_votes} fan scores* — {', '.join(valid_strings)}."
 
 
+# Compact listing of every decision on an event card. Returns a list of replies, each one short
+# enough to fit in a single Reddit comment.
+def build_event_reply(fight_info, comment_author) -> List[str]:
+    header = ''
+    if fight_info[0][3] is not None:
+        header = '**' + fight_info[0][3].strip('^()') + '**\n\n'
+    footer = '\n*^(Summoned by {}.)*'.format(comment_author)
+
+    fight_texts = []
+    for fight in fight_info:
+        score_tables, fight_result, media_scores = fight[0], fight[1], fight[2]
+        if score_tables is None or fight_result is None:
+            continue
+        totals = ', '.join(table[-1][1] + '-' + table[-1][2] for judge, table in score_tables)
+        fight_texts.append('- {} — Judges: {} — {}\n'.format(fight_result, totals,
+                                                              _get_media_consensus_text(media_scores)))
+
+    return split_reply(fight_texts, header, footer)
+
+
+# One reply for a comment asking for several fights: the full reply of every fight found, and a line for
+# each fight that wasn't. Returns the replies, split to fit Reddit's comment length limit.
+def build_batch_reply(input_fights, fight_infos, comment_author) -> List[str]:
+    blocks = []
+    missing = []
+    for input_fight, fight_info in zip(input_fights, fight_infos):
+        if not fight_info or any(fight[0] is None for fight in fight_info):
+            missing.append(input_fight)
+            continue
+        for fight in fight_info:
+            blocks.append(build_comment_reply(fight[0], fight[1], fight[2], fight[3], fight[4], comment_author)
+                          + '\n\n---\n\n')
+    if missing:
+        blocks.append('I couldn\'t find {}. Check your spelling, or maybe the fight didn\'t end in a decision.{}\n'
+                      .format(', '.join('**' + string.capwords(input_fight) + '**' for input_fight in missing),
+                              troubleshoot_text))
+    return split_reply(blocks, '', '')
+
+
+def _get_media_consensus_text(media_scores) -> str:
+    if not media_scores:
+        return 'No media scores'
+    fighter, count = Counter(score[1] for score in media_scores).most_common(1)[0]
+    return 'Media: {}/{} {}'.format(count, len(media_scores), fighter)
+
+
+# Pack blocks of text into as few replies as possible without going over Reddit's comment length limit
+def split_reply(blocks: List[str], header: str, footer: str) -> List[str]:
+    max_length = cfg['max_reply_length'] - len(footer)
+    replies = []
+    reply = header
+    for block in blocks:
+        if len(reply) + len(block) > max_length and reply != header:
+            replies.append(reply + footer)
+            reply = header
+        reply += block
+    if reply != header or not replies:
+        replies.append(reply + footer)
+    return replies
+
+
+def build_fighter_summary_text(summary, comment_author) -> str:
+    record = summary['record']
+    text = '**{}** — {} decisions on record\n\n'.format(summary['fighter'].upper(), summary['num_fights'])
+
+    methods = ('unanimous', 'split', 'majority')
+    text += 'RESULT|' + '|'.join(method.capitalize() for method in methods) + '|Total\n'
+    text += ':-:' + '|:-:' * (len(methods) + 1) + '\n'
+    for outcome in ('W', 'L', 'D'):
+        counts = record[outcome]
+        text += '**{}**|'.format(outcome) + '|'.join(str(counts[method]) for method in methods) + \
+                '|{}\n'.format(sum(counts.values()))
+
+    if summary['judges']:
+        text += '\nMost frequent judges: ' + \
+                ', '.join('{} ({})'.format(judge, count) for judge, count in summary['judges']) + '.\n'
+
+    if summary['disagreements']:
+        text += '\n**BIGGEST MEDIA DISAGREEMENTS**\n\n'
+        for dissent, total, fight_result in summary['disagreements']:
+            text += '- {} — **{}/{}** media members disagreed.\n'.format(fight_result, dissent, total)
+
+    return text + '\n*^(Summoned by {}.)*'.format(comment_author)
+
+
+def build_robberies_text(robberies, event_name, comment_author) -> str:
+    if event_name:
+        text = '**BIGGEST MEDIA DISAGREEMENTS — {}**\n\n'.format(event_name.upper())
+    else:
+        text = '**BIGGEST ROBBERIES**\n\n'
+    for fight_result, dissent, total in robberies:
+        text += '- {} — **{}/{}** media members disagreed.\n'.format(fight_result, dissent, total)
+    return text + '\n*^(Summoned by {}.)*'.format(comment_author)
+
+
+def build_judge_stats_text(stats, comment_author) -> str:
+    text = '**JUDGE {}** — {} scorecards on record\n\n'.format(stats['judge'].upper(), stats['scorecards'])
+    text += '- Dissented from the other two judges on **{}/{}** scorecards.\n'.format(stats['dissents'],
+                                                                                      stats['scorecards'])
+    if stats['media_fights']:
+        text += '- Agreed with the media majority on **{}/{}** fights.\n'.format(stats['media_agreements'],
+                                                                                 stats['media_fights'])
+    return text + '\n*^(Summoned by {}.)*'.format(comment_author)
+
+
+# Nickname and rematch data used to clean up user input. Swapped out as a whole when a file changes.
+class BotData(NamedTuple):
+    nickname_dict: dict
+    rematch_list: list
+
+
+def load_bot_data() -> BotData:
+    # Create the dictionary of nicknames to be replaced
+    nickname_dict = create_nickname_dict(cfg['nickname_db'])
+    # Create the rematch list to narrow down searches
+    rematch_list = create_rematch_list(cfg['rematch_db'])
+    # Both files are full of real fighter names, which help guess where one name ends and the other starts.
+    # Nicknames often stand for a first or last name alone (ex. "rumble" for "anthony"), so only the ones naming
+    # more than one word are taken for full names.
+    nicknames = list(nickname_dict.values())
+    ff.add_known_names([name for name in nicknames if len(name.split()) > 1] +
+                       [name for rematch in rematch_list for name in rematch[2:]])
+    ff.add_known_name_fragments(name for name in nicknames if len(name.split()) == 1)
+    return BotData(nickname_dict, rematch_list)
+
+
+# Polls the modification times of config.yaml and the nickname and rematch files, so that edits are
+# picked up while the bot keeps running, without bin/restart.sh
+class Reloader:
+    def __init__(self):
+        self.data = load_bot_data()
+        self._mtimes = self._get_mtimes()
+        self._checked_at = time.monotonic()
+
+    # Returns the current data, first reloading any files that changed since the last check
+    def get_data(self) -> BotData:
+        if time.monotonic() - self._checked_at >= cfg['reload_interval']:
+            self._checked_at = time.monotonic()
+            self._reload_changed_files()
+        return self.data
+
+    def _get_mtimes(self):
+        mtimes = {}
+        for path in (CONFIG_FILE, cfg['nickname_db'], cfg['rematch_db']):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def _reload_changed_files(self):
+        mtimes = self._get_mtimes()
+        if mtimes == self._mtimes:
+            return
+        changed_files = [path for path in mtimes if mtimes[path] != self._mtimes.get(path)]
+
+        if mtimes.get(CONFIG_FILE) != self._mtimes.get(CONFIG_FILE):
+            logger.info('Reloading {}...'.format(CONFIG_FILE))
+            try:
+                with open(CONFIG_FILE, 'r') as f:
+                    new_cfg = yaml.load(f)
+            except (OSError, yaml.YAMLError):
+                log_error('Could not reload {}, keeping the current config'.format(CONFIG_FILE), sys.exc_info())
+                self._mtimes = mtimes
+                return
+            # An empty or half-saved file loads as None, a string, or a dict missing keys
+            if not isinstance(new_cfg, dict) or not set(cfg) <= set(new_cfg):
+                missing_keys = sorted(set(cfg) - set(new_cfg)) if isinstance(new_cfg, dict) else list(cfg)
+                logger.warning('{} is incomplete, keeping the current config'.format(CONFIG_FILE))
+                event_log.log('error', text='{} is incomplete, keeping the current config'.format(CONFIG_FILE),
+                              missing_keys=missing_keys)
+                self._mtimes = mtimes
+                return
+            apply_config(new_cfg)
+            ff.apply_config(new_cfg)
+            # The nickname or rematch file may have been changed to a different one
+            mtimes = self._get_mtimes()
+
+        # Build the new data completely before swapping it in, so a comment never sees half of it
+        logger.info('Reloading nicknames and rematches...')
+        self.data = load_bot_data()
+        self._mtimes = mtimes
+        event_log.log('reload', files=changed_files)
+
+
+def apply_config(new_cfg):
+    global troubleshoot_text, phrases
+    # Update keys in place rather than replacing cfg, so code holding a reference sees every key at all times
+    cfg.update(new_cfg)
+    troubleshoot_text = cfg['troubleshoot_text']
+    phrases = cfg['fail_phrases']
+    if cfg['log_name'] != log or cfg['comment_log_name'] != comment_log:
+        logger.warning('Log file names can\'t change while the bot is running, restart to use the new ones.')
+
+
 # Replace nicknames and common name mistakes in user input
 def create_nickname_dict(nickname_db):
     nickname_dict = {}
@@ -291,7 +499,8 @@ def get_trigger_index(text):
         index = text.find(word + ' bot')
         if index != -1:
             return index
-    return -1
+    # Username mentions, ex. "u/decisionbot"
+    return text.find('u/' + cfg['username'].lower())
 
 
 # Reduce the input text to just the fight string
@@ -299,11 +508,25 @@ def sanitize_input(text):
     # Only take the first line of comment
     if '\n' in text:
         text = text.split('\n')[0]
-    # Remove trigger word
+    return _remove_trigger(text).strip(string.punctuation + ' ')
+
+
+def _remove_trigger(text):
+    text = text.replace('u/' + cfg['username'].lower(), '').replace(cfg['username'].lower(), '')
     for word in cfg['decision_spellings']:
         text = text.replace(word + 'bot', '').replace(word + ' bot', '')
+    return text
 
-    return text.strip(string.punctuation + ' ')
+
+# Fights asked for in a comment that asks for several at once, ex. "decisionbot edgar vs maynard, lawler vs
+# hendricks", or one fight per line. Only parts naming two fighters count, and at most max_batch_fights.
+def get_batch_queries(text) -> List[str]:
+    queries = []
+    for part in re.split(r'[,;\n]', _remove_trigger(text)):
+        part = part.strip(string.punctuation + ' ')
+        if ff.get_fighters_from_input(part)[0] and part not in queries:
+            queries.append(part)
+    return queries[:cfg['max_batch_fights']]
 
 
 # Cycle through the list of failure phrases
@@ -393,60 +616,62 @@ def get_commented_set() -> Set[str]:
 
 
 def log_message(comment_body, message):
-    try:
-        with open(log, 'a') as f:
-            f.write(comment_body + '\n' + message + '\n')
-            f.write('-------------\n')
-    except FileNotFoundError:
-        logger.exception('File \'{}\' not found!'.format(log))
-        logger.error(comment_body + '\n' + message)
+    event_log.log('message', comment=comment_body, message=message)
 
 
 def log_error(text, exc_info):
-    try:
-        with open(log, 'a') as f:
-            f.write(text + '\n')
-            traceback.print_exception(exc_info[0], exc_info[1], exc_info[2], file=f)
-            f.write('-------------\n')
-    except FileNotFoundError:
-        logger.exception('File \'{}\' not found!'.format(log))
-        logger.error(text + '\n')
-        traceback.print_exception(exc_info[0], exc_info[1], exc_info[2], file=sys.stdout)
+    event_log.log('error', text=text,
+                  traceback=''.join(traceback.format_exception(exc_info[0], exc_info[1], exc_info[2])))
 
 
 def log_comment(comment_id):
-    try:
-        with open(comment_log, 'a') as f:
-            f.write(comment_id + '\n')
-    except FileNotFoundError:
-        logger.exception('File \'{}\' not found!'.format(comment_log))
-        logger.error('Comment ID being logged: {}'.format(comment_id))
-
-
-def send_reply(fight_info, comment, input_fight):
+    commented_log.write_line(comment_id)
+
+
+# One record per handled summon: what was asked, which fights were found, how long it took, how it ended and
+# fight_finder's site health counters. Page layout switches seen since the last summon get a record each.
+def log_query(comment, input_fight, query_type, fight_info, start_time, outcome):
+    fight_urls = []
+    for fight in fight_info or []:
+        url = re.search(r'\]\((.*)\)$', fight[1] or '')
+        if url is not None:
+            fight_urls.append(url.group(1))
+    event_log.log('query', comment_id=comment.id, author=comment.author.name if comment.author else None,
+                  query=input_fight, query_type=query_type, fight_urls=fight_urls,
+                  seconds=round(time.monotonic() - start_time, 3), outcome=outcome, site_status=ff.get_site_status(),
+                  metrics=ff.get_metrics())
+    for switch in ff.pop_layout_switches():
+        event_log.log('layout_switch', **switch)
+
+
+def build_fight_replies(fight_info, input_fight, comment_author) -> List[str]:
     # Retrieved fight info
     if fight_info:
-        count = 0
+        replies = []
         for fight in fight_info:
             if fight[0] is None:
-                log_and_reply(generate_fail_text(input_fight, comment.author.name), comment)
+                replies.append(generate_fail_text(input_fight, comment_author))
                 break
-            else:
-                # Make sure the bot isn't commenting too fast
-                if count != 0:
-                    time.sleep(5)
-                    logger.info('Sending reply with next fight...')
-                log_and_reply(build_comment_reply(fight[0], fight[1], fight[2], fight[3], fight[4], comment.author.name), comment)
-                count += 1
+            replies.append(build_comment_reply(fight[0], fight[1], fight[2], fight[3], fight[4], comment_author))
+        return replies
     # Easter egg jokes
     elif 'dana' in input_fight:
-        log_and_reply('Dana defeats Goof' + generate_victory_method(), comment)
+        return ['Dana defeats Goof' + generate_victory_method()]
     elif 'usada' in input_fight:
-        log_and_reply('USADA' + generate_victory_method(), comment)
+        return ['USADA' + generate_victory_method()]
     elif 'khabib' in input_fight or 'nurmagomedov' in input_fight:
-        log_and_reply("Khabib by smesh." + troubleshoot_text, comment)
+        return ["Khabib by smesh." + troubleshoot_text]
     else:
-        log_and_reply(generate_fail_text(input_fight, comment.author.name), comment)
+        return [generate_fail_text(input_fight, comment_author)]
+
+
+def send_replies(replies, comment):
+    for i in range(len(replies)):
+        # Make sure the bot isn't commenting too fast
+        if i != 0:
+            time.sleep(5)
+            logger.info('Sending next reply...')
+        log_and_reply(replies[i], comment)
 
 
 def log_and_reply(text, comment):
@@ -459,11 +684,147 @@ def generate_victory_method():
     return ' by ' + random.choice(methods) + '.'
 
 
-def notify_myself(reddit, comment):
+# Sends my account a digest of triggers every notify_digest_interval seconds, and errors right away. Runs on
+# its own thread with its own Reddit client, so notifications never delay or rate limit the bot's replies.
+class OwnerNotifier:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._reddit = None
+        self._thread = threading.Thread(target=self._run, name='owner_notifier', daemon=True)
+        self._thread.start()
+
+    def add_trigger(self, text):
+        self._queue.put((False, text))
+
+    def add_error(self, text):
+        self._queue.put((True, text))
+
+    def _run(self):
+        triggers = []
+        digest_time = time.monotonic() + cfg['notify_digest_interval']
+        while True:
+            try:
+                is_error, text = self._queue.get(timeout=max(digest_time - time.monotonic(), 0))
+                if is_error:
+                    self._send('DecisionBot error', [text])
+                else:
+                    triggers.append(text)
+            except queue.Empty:
+                pass
+            if time.monotonic() >= digest_time:
+                if triggers:
+                    self._send('DecisionBot triggered {} time{}'.format(len(triggers), '' if len(triggers) == 1
+                                                                        else 's'), triggers)
+                    triggers = []
+                digest_time = time.monotonic() + cfg['notify_digest_interval']
+
+    def _send(self, subject, texts):
+        if not cfg['personal_username']:
+            return
+        try:
+            if self._reddit is None:
+                self._reddit = create_reddit()
+            # Reddit messages are limited to 10000 characters, like comments
+            for message in split_reply([text + '\n\n---\n\n' for text in texts], '', ''):
+                self._reddit.redditor(cfg['personal_username']).message(subject, message)
+        except Exception:
+            log_error('Could not send notification: ' + subject, sys.exc_info())
+
+
+notifier = OwnerNotifier()
+
+
+# Warms fight_finder's caches for tonight's card. Every live_thread_check_interval seconds it looks for live
+# discussion threads (ex. "Official UFC 250 Live Discussion Thread") in the target subreddits and reads the
+# fights listed in them. Every live_poll_interval seconds it searches those fights again, until a decision
+# that wasn't there on the first poll shows up for each, so summons right after a decision are answered warm.
+class LiveEventPrefetcher:
+    def __init__(self):
+        self._reddit = None
+        # Live thread id -> {(fighter 1, fighter 2): [polls so far, decision urls found on the first poll]}
+        self._cards = {}
+        self._thread = threading.Thread(target=self._run, name='live_prefetcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        next_check = 0
+        while True:
+            try:
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + cfg['live_thread_check_interval']
+                    self._find_live_threads()
+                self._poll()
+            except Exception:
+                log_error('Live event prefetch failed', sys.exc_info())
+            time.sleep(cfg['live_poll_interval'])
+
+    def _find_live_threads(self):
+        if self._reddit is None:
+            self._reddit = create_reddit()
+        pattern = re.compile(cfg['live_thread_pattern'], re.IGNORECASE)
+        live_ids = set()
+        for submission in self._reddit.subreddit(cfg['target_subreddits']).hot(limit=cfg['live_thread_limit']):
+            if not pattern.search(submission.title) or \
+                    time.time() - submission.created_utc > cfg['live_thread_max_age'] * 3600:
+                continue
+            live_ids.add(submission.id)
+            if submission.id not in self._cards:
+                card = get_card_from_thread(submission.selftext)
+                logger.info('Found live thread \'{}\' with {} fights'.format(submission.title, len(card)))
+                event_log.log('live_thread', thread_id=submission.id, title=submission.title, fights=card)
+                self._cards[submission.id] = {fight: [0, None] for fight in card}
+
+        # Stop polling threads that are over
+        for thread_id in list(self._cards):
+            if thread_id not in live_ids:
+                del self._cards[thread_id]
+
+    # A fight is dropped once a new decision is found, or after live_max_polls polls (ex. it ended in a finish)
+    def _poll(self):
+        for card in self._cards.values():
+            if not card:
+                continue
+            for fight, fight_urls in ff.prefetch_fights(list(card)).items():
+                state = card[fight]
+                state[0] += 1
+                if state[1] is None:
+                    state[1] = set(fight_urls)
+                elif set(fight_urls) - state[1]:
+                    logger.info('New decision for {} vs {} prefetched'.format(*fight))
+                    event_log.log('prefetch', fight=fight, fight_urls=sorted(set(fight_urls) - state[1]))
+                    del card[fight]
+                    continue
+                if state[0] >= cfg['live_max_polls']:
+                    logger.info('No new decision for {} vs {} after {} polls, dropping it'.format(*fight, state[0]))
+                    del card[fight]
+
+
+# Fights listed in a live thread, one per line (ex. "Main card: Amanda Nunes vs. Felicia Spencer" or a table
+# row like "| 145 | Amanda Nunes | vs | Felicia Spencer |")
+def get_card_from_thread(text) -> List[Tuple[str, str]]:
+    card = []
+    for line in text.lower().split('\n'):
+        # Keep link text, and drop markdown, parenthesized notes, weights and labels like "main card:"
+        line = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', line)
+        line = re.sub(r'\([^)]*\)|[|*#>_~]|\S*\d\S*', ' ', line).split(':')[-1]
+        fighter_1, fighter_2, fight_num = ff.get_fighters_from_input(' '.join(line.split()))
+        if not fighter_1 or not fighter_2 or len(fighter_1.split()) > 4 or len(fighter_2.split()) > 4:
+            continue
+        # Table headers like "| Fighter | vs | Fighter |" name the same thing on both sides
+        if fighter_1.split()[-1] != fighter_2.split()[-1] and (fighter_1, fighter_2) not in card:
+            card.append((fighter_1, fighter_2))
+    return card
+
+
+def notify_myself(comment):
+    # Inbox comments come with a context link instead of a permalink, and asking them for a permalink would
+    # fetch the whole comment from Reddit again
+    path = comment.context if 'context' in vars(comment) else comment.permalink
     # Permalink requires different formatting for desktop vs. mobile website
-    permalink = 'www.reddit.com' + comment.permalink
-    reddit.redditor(cfg['personal_username']).message(
-        'DecisionBot triggered',
+    permalink = 'www.reddit.com' + path
+    notifier.add_trigger(
         comment.body
         + '\n\nMobile: \n\n' + permalink.replace('//', '/')
         + '\n\nDesktop: \n\n' + permalink)
@@ -473,94 +834,303 @@ def notify_myself(reddit, comment):
 def tester():
     nickname_dict = create_nickname_dict(cfg['nickname_db'])
     rematch_list = create_rematch_list(cfg['rematch_db'])
-    fail_text = 'I couldn\'t find this fight! Check your spelling, or maybe the fight didn\'t end in a decision.'
 
     while True:
         print('Enter fight:')
         input_fight = input()
-        input_fight = replace_nicknames(input_fight, nickname_dict)
         print('Searching...')
-        fight_info, fight_num = ff.get_fight_info_from_input(input_fight)
-        fight_info = handle_rematch(fight_info, fight_num, rematch_list)
-        if not fight_info:
-            print(fail_text)
+        input_fights = get_batch_queries(input_fight)
+        if len(input_fights) > 1:
+            fight_infos, replies = get_batch_replies(input_fights, 'test_author', nickname_dict, rematch_list)
         else:
-            for fight in fight_info:
-                if fight[0] is None:
-                    print(fail_text)
-                else:
-                    print(build_comment_reply(fight[0], fight[1], fight[2], fight[3], fight[4], 'test_author'))
+            query_type, fight_info, replies, found = get_query_replies(input_fight, 'test_author', nickname_dict,
+                                                                       rematch_list)
+        for reply in replies:
+            print(reply)
+
+
+def process_comment(comment, text, nickname_dict, rematch_list):
+    start_time = time.monotonic()
+    # Let me know that the bot has been triggered
+    notify_myself(comment)
+    # Several fights asked for at once get one consolidated reply
+    input_fights = get_batch_queries(text)
+    if len(input_fights) > 1:
+        input_fight = ', '.join(input_fights)
+        query_type, fight_info, found = reply_to_batch_query(comment, input_fights, nickname_dict, rematch_list)
+    else:
+        # Sanitize the input to just get the fight string
+        input_fight = sanitize_input(text)
+        query_type, fight_info, found = reply_to_query(comment, input_fight, nickname_dict, rematch_list)
+    logger.info('Success!\n')
+    log_query(comment, input_fight, query_type, fight_info, start_time, 'replied' if found else 'not_found')
+
+
+# Work out what kind of query the input is and reply to it. Returns (query type, fight info, whether anything was found).
+def reply_to_query(comment, input_fight, nickname_dict, rematch_list):
+    query_type, fight_info, replies, found = get_query_replies(input_fight, comment.author.name, nickname_dict,
+                                                               rematch_list)
+    logger.info('Sending reply to {} query...'.format(query_type))
+    send_replies(replies, comment)
+    return query_type, fight_info, found
+
+
+# Look up a query and build the reply texts, or the failure text if nothing was found.
+# Returns (query type, fight info, replies, whether anything was found).
+def get_query_replies(input_fight, comment_author, nickname_dict, rematch_list):
+    # Robbery ranking query, ex. "decisionbot robberies ufc 202"
+    is_robbery_query, event_name = ff.get_robbery_query_from_input(input_fight)
+    if is_robbery_query:
+        robberies = ff.get_robberies(event_name)
+        if not robberies:
+            return 'robberies', None, [get_failure_phrase(comment_author)], False
+        return 'robberies', None, [build_robberies_text(robberies, event_name, comment_author)], True
+
+    # Judge stats query, ex. "decisionbot judge derek cleary"
+    judge = ff.get_judge_name_from_input(input_fight)
+    if judge is not None:
+        stats = ff.get_judge_stats(judge)
+        if not stats:
+            return 'judge', None, [get_failure_phrase(comment_author)], False
+        return 'judge', None, [build_judge_stats_text(stats, comment_author)], True
+
+    # Fighter career summary query, ex. "decisionbot fighter nate diaz"
+    fighter = ff.get_fighter_name_from_input(input_fight)
+    if fighter is not None:
+        summary = ff.get_fighter_summary(replace_nicknames(fighter, nickname_dict))
+        if not summary or summary['num_fights'] == 0:
+            return 'fighter', None, [get_failure_phrase(comment_author)], False
+        return 'fighter', None, [build_fighter_summary_text(summary, comment_author)], True
+
+    # Event card query, ex. "decisionbot UFC 202"
+    if ff.is_event_query(input_fight):
+        fight_info = ff.get_event_fight_info(input_fight)
+        if not fight_info:
+            return 'event', fight_info, [generate_fail_text(input_fight, comment_author)], False
+        return 'event', fight_info, build_event_reply(fight_info, comment_author), True
 
+    # Replace nicknames in input
+    input_fight = replace_nicknames(input_fight, nickname_dict)
+    # Retrieve all the fight info
+    fight_info, fight_num = ff.get_fight_info_from_input(input_fight)
+    # Handle if user entered a rematch number
+    fight_info = handle_rematch(fight_info, fight_num, rematch_list)
+    return 'fight', fight_info, build_fight_replies(fight_info, input_fight, comment_author), bool(fight_info)
 
-# Run the bot, retrying whenever there is an unavoidable connection reset
-@retry(delay=30, logger=logger)
-def run(nickname_dict, rematch_list):
+
+def reply_to_batch_query(comment, input_fights, nickname_dict, rematch_list):
+    fight_infos, replies = get_batch_replies(input_fights, comment.author.name, nickname_dict, rematch_list)
+    logger.info('Sending reply with {} fights...'.format(len(input_fights)))
+    send_replies(replies, comment)
+    fight_info = [fight for info in fight_infos if info for fight in info]
+    return 'batch', fight_info, bool(fight_info)
+
+
+# Returns (fight info of each input fight, replies)
+def get_batch_replies(input_fights, comment_author, nickname_dict, rematch_list):
+    results = ff.get_fight_info_batch([replace_nicknames(input_fight, nickname_dict) for input_fight in input_fights])
+    fight_infos = [handle_rematch(fight_info, fight_num, rematch_list) for fight_info, fight_num in results]
+    if not any(fight_infos):
+        return fight_infos, [generate_fail_text(input_fights[0], comment_author)]
+    return fight_infos, build_batch_reply(input_fights, fight_infos, comment_author)
+
+
+# Run the bot. The Reddit client is only built once, and the stream reconnects on its own after connection resets.
+def run(reloader):
     # Log date and time
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logger.info('[' + now + '] Starting up DecisionBot...')
 
     # Authentication
-    reddit = praw.Reddit(
-        client_id=cfg['client_id'],
-        client_secret=cfg['client_secret'],
-        user_agent=cfg['user_agent'],
-        username=cfg['username'],
-        password=cfg['pw'])
+    reddit = create_reddit()
+
+    if cfg['live_prefetch']:
+        LiveEventPrefetcher().start()
 
     # Monitoring incoming comment stream from subreddit
     subreddit = reddit.subreddit(cfg['target_subreddits'])
 
     # Open log of previous bot comments
     commented_set = get_commented_set()
+    # Where the bot left off last time
+    checkpoint = load_checkpoint()
 
-    for comment in subreddit.stream.comments():
-        text = comment.body.lower().strip()
-        index = get_trigger_index(text)
-        # Found a match
-        if index != -1:
+    stream_comments(reddit, subreddit, commented_set, checkpoint, reloader)
+
+
+def create_reddit():
+    return praw.Reddit(
+        client_id=cfg['client_id'],
+        client_secret=cfg['client_secret'],
+        user_agent=cfg['user_agent'],
+        username=cfg['username'],
+        password=cfg['pw'])
+
+
+# Retry whenever there is an unavoidable connection reset
+@retry(delay=30, logger=logger)
+def stream_comments(reddit, subreddit, commented_set, checkpoint, reloader):
+    logger.info('Connecting to comment stream...')
+    use_subreddits = cfg['trigger_source'] in ('subreddits', 'both')
+    use_inbox = cfg['trigger_source'] in ('inbox', 'both')
+
+    # Catch up on anything posted while the bot was down, oldest first. Unread inbox items are
+    # caught up on by the inbox stream itself.
+    if use_subreddits:
+        for comment in get_missed_comments(subreddit, checkpoint):
+            handle_comment(reddit, comment, commented_set, checkpoint, reloader)
+
+    for comment, from_inbox in get_trigger_stream(reddit, subreddit, use_subreddits, use_inbox):
+        if from_inbox:
+            handle_comment(reddit, comment, commented_set, None, reloader)
+            reddit.inbox.mark_read([comment])
+            continue
+        # The stream starts by replaying recent comments, most of which were already handled
+        if comment.created_utc < checkpoint['created_utc'] or comment.id == checkpoint['comment_id']:
+            continue
+        handle_comment(reddit, comment, commented_set, checkpoint, reloader)
+
+
+# Yields (comment, whether it came from the inbox). The subreddit stream reads every comment in the target
+# subreddits. The inbox stream only gets username mentions and replies to the bot, so it works in any
+# subreddit at the cost of a single listing request per poll.
+def get_trigger_stream(reddit, subreddit, use_subreddits, use_inbox):
+    if not use_inbox:
+        for comment in subreddit.stream.comments():
+            yield comment, False
+        return
+    if not use_subreddits:
+        for item in reddit.inbox.stream():
+            # Skip private messages
+            if isinstance(item, praw.models.Comment):
+                yield item, True
+        return
+
+    # Take turns between both streams. pause_after makes each one give up control once it has no new items,
+    # before its own backoff, so rounds without new items wait here instead (doubling up to 16 seconds, like
+    # praw's streams) to keep the polling within the rate limit the replies also use.
+    comment_stream = subreddit.stream.comments(pause_after=-1)
+    inbox_stream = reddit.inbox.stream(pause_after=-1)
+    wait = 1
+    while True:
+        found = False
+        for comment in comment_stream:
+            if comment is None:
+                break
+            found = True
+            yield comment, False
+        for item in inbox_stream:
+            if item is None:
+                break
+            found = True
+            if isinstance(item, praw.models.Comment):
+                yield item, True
+        if found:
+            wait = 1
+        else:
+            time.sleep(wait)
+            wait = min(wait * 2, 16)
+
+
+def handle_comment(reddit, comment, commented_set, checkpoint, reloader):
+    # Pick up any edits to the nickname, rematch and config files
+    data = reloader.get_data()
+    text = comment.body.lower().strip()
+    index = get_trigger_index(text)
+    # Found a match
+    if index != -1:
+        try:
+            # Make sure bot hasn't already commented
+            if comment.id not in commented_set:
+                commented_set.add(comment.id)
+                process_comment(comment, text[index:], data.nickname_dict, data.rematch_list)
+
+        except (AttributeError, PRAWException):
+            logger.exception('Error occurred...')
+            log_error(comment.body, sys.exc_info())
+            event_log.log('query', comment_id=comment.id, query=text, outcome='error')
+            notifier.add_error('Error occurred at comment: ' + comment.body + '\n\n' +
+                               ''.join(traceback.format_exception_only(*sys.exc_info()[:2])))
             try:
-                # Make sure bot hasn't already commented
-                if comment.id not in commented_set:
-                    # Let me know that the bot has been triggered
-                    notify_myself(reddit, comment)
-                    # Sanitize the input to just get the fight string
-                    input_fight = sanitize_input(text[index:])
-                    # Replace nicknames in input
-                    input_fight = replace_nicknames(input_fight, nickname_dict)
-                    # Retrieve all the fight info
-                    fight_info, fight_num = ff.get_fight_info_from_input(input_fight)
-                    # Handle if user entered a rematch number
-                    fight_info = handle_rematch(fight_info, fight_num, rematch_list)
-                    logger.info('Sending reply to initial comment...')
-                    send_reply(fight_info, comment, input_fight)
-                    logger.info('Success!\n')
-
-            except (AttributeError, PRAWException):
-                logger.exception('Error occurred...')
-                log_error(comment.body, sys.exc_info())
-                try:
-                    log_and_reply('I couldn\'t find this fight!' + troubleshoot_text, comment)
-                except PRAWException:
-                    log_error('Error occurred at comment: ' + comment.body, sys.exc_info())
+                log_and_reply('I couldn\'t find this fight!' + troubleshoot_text, comment)
+            except PRAWException:
+                log_error('Error occurred at comment: ' + comment.body, sys.exc_info())
+
+    # Inbox items aren't part of the subreddit stream, so they don't move its checkpoint
+    if checkpoint is not None:
+        update_checkpoint(checkpoint, comment, force=index != -1)
+
+
+# Comments newer than the checkpoint, oldest first. Reddit listings go back at most ~1000 comments.
+def get_missed_comments(subreddit, checkpoint):
+    if not checkpoint['comment_id']:
+        return []
+
+    missed_comments = []
+    for comment in subreddit.comments(limit=cfg['backfill_limit']):
+        if comment.created_utc < checkpoint['created_utc'] or comment.id == checkpoint['comment_id']:
+            break
+        missed_comments.append(comment)
+    if missed_comments:
+        logger.info('Backfilling {} comments missed since the last checkpoint...'.format(len(missed_comments)))
+    missed_comments.reverse()
+    return missed_comments
+
+
+def load_checkpoint():
+    checkpoint = {'comment_id': None, 'created_utc': 0, 'saved_at': time.monotonic()}
+    try:
+        with open(cfg['checkpoint_name'], 'r') as f:
+            saved = json.load(f)
+        checkpoint['comment_id'] = saved['comment_id']
+        checkpoint['created_utc'] = saved['created_utc']
+    except FileNotFoundError:
+        logger.info('No checkpoint found, starting from the live stream.')
+    except (ValueError, KeyError):
+        logger.exception('Could not read checkpoint \'{}\''.format(cfg['checkpoint_name']))
+    return checkpoint
+
+
+# Remember the last handled comment. It's saved to disk after every summon, and otherwise at most every
+# checkpoint_interval seconds so that busy streams don't write the file on every comment.
+def update_checkpoint(checkpoint, comment, force=False):
+    if comment.created_utc < checkpoint['created_utc']:
+        return
+    checkpoint['comment_id'] = comment.id
+    checkpoint['created_utc'] = comment.created_utc
+    if force or time.monotonic() - checkpoint['saved_at'] >= cfg['checkpoint_interval']:
+        checkpoint['saved_at'] = time.monotonic()
+        tmp_name = cfg['checkpoint_name'] + '.tmp'
+        try:
+            with open(tmp_name, 'w') as f:
+                json.dump({'comment_id': comment.id, 'created_utc': comment.created_utc}, f)
+            os.replace(tmp_name, cfg['checkpoint_name'])
+        except OSError:
+            log_error('Could not save checkpoint', sys.exc_info())
 
 
 def main():
     # Command-line options parser
     parser = argparse.ArgumentParser(description='Reddit bot that searches and posts MMA scorecards.')
     parser.add_argument('-d', '--debug', action='store_true', dest='debug', help='Print logging info to stdout.')
+    parser.add_argument('-w', '--corpus-writer', action='store_true', dest='corpus_writer',
+                        help='Add parsed decisions to the shared corpus file and save it. Run one writer at most.')
     args = parser.parse_args()
 
+    if args.corpus_writer or ff.corpus_writer:
+        ff.start_corpus_writer()
+    # bin/stop.sh stops the bot with SIGTERM. Exit normally instead, so the corpus and logs are saved at exit.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     if args.debug:
         logger.setLevel(logging.INFO)
         ff.logger.setLevel(logging.INFO)
 
-    # Create the dictionary of nicknames to be replaced
-    nickname_dict = create_nickname_dict(cfg['nickname_db'])
-    # Create the rematch list to narrow down searches
-    rematch_list = create_rematch_list(cfg['rematch_db'])
+    # Create the nickname dictionary and rematch list, reloaded whenever their files change
+    reloader = Reloader()
     try:
         # Run bot, with retry (because of connection resets)
-        run(nickname_dict, rematch_list)
+        run(reloader)
     except (ConnectionResetError, PRAWException, AttributeError):
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         logger.exception('[' + now + '] Retrying failed, DecisionBot shutting down.')
@@ -0,0 +1,572 @@
+import os
+import re
+import mmap
+import struct
+import threading
+import logging
+import numpy as np
+from unidecode import unidecode
+from typing import Optional, List, Tuple
+
+logger = logging.getLogger('DECISION_CORPUS')
+
+# Score arrays are fixed width. Fights with more judges or rounds are truncated.
+MAX_JUDGES = 3
+MAX_ROUNDS = 5
+# Media picks, by scorecard column. Picks naming neither fighter are stored as unknown.
+PICK_FIGHTER_1 = 0
+PICK_FIGHTER_2 = 1
+PICK_DRAW = 2
+PICK_UNKNOWN = 3
+# Pick as a sign, like official_winners(): +1 for fighter 1, -1 for fighter 2, 0 for a draw or unknown
+_PICK_SIGNS = np.array([1, -1, 0, 0], dtype=np.int8)
+
+# On-disk format: magic, then counts of fights, media scores, strings and string bytes, then each array below
+# in order, little-endian and 8-byte aligned. Offsets follow from the counts, so there's no offset table.
+FILE_MAGIC = b'DCORPUS2'
+_HEADER = struct.Struct('<8sQQQQ')
+# Array name, dtype, and shape in terms of the number of fights (n), media scores (m), strings (s) and string bytes (b)
+_FILE_ARRAYS = (
+    ('index_ids', '<i4', lambda n, m, s, b: (n,)),
+    ('index_rows', '<i4', lambda n, m, s, b: (n,)),
+    ('decision_ids', '<i4', lambda n, m, s, b: (n,)),
+    ('result_ids', '<i4', lambda n, m, s, b: (n,)),
+    ('event_ids', '<i4', lambda n, m, s, b: (n,)),
+    ('fighter_ids', '<i4', lambda n, m, s, b: (n, 2)),
+    ('judge_ids', '<i4', lambda n, m, s, b: (n, MAX_JUDGES)),
+    ('num_judges', '<i1', lambda n, m, s, b: (n,)),
+    ('num_rounds', '<i1', lambda n, m, s, b: (n,)),
+    ('round_scores', '<i2', lambda n, m, s, b: (n, MAX_JUDGES, MAX_ROUNDS, 2)),
+    ('totals', '<i2', lambda n, m, s, b: (n, MAX_JUDGES, 2)),
+    ('fan_votes', '<i4', lambda n, m, s, b: (n, 3)),
+    ('media_offsets', '<i8', lambda n, m, s, b: (n + 1,)),
+    ('media_scores', '<i2', lambda n, m, s, b: (m, 2)),
+    ('media_picks', '<i1', lambda n, m, s, b: (m,)),
+    ('string_offsets', '<i8', lambda n, m, s, b: (s + 1,)),
+    ('string_bytes', '<u1', lambda n, m, s, b: (b,)),
+)
+# Arrays with one entry per fight, grown together
+_FIGHT_ARRAYS = ('decision_ids', 'result_ids', 'event_ids', 'fighter_ids', 'judge_ids', 'num_judges',
+                 'num_rounds', 'round_scores', 'totals', 'fan_votes')
+
+
+# Columnar store of every decision the bot has parsed. Each fight is a row in a set of NumPy arrays
+# (judge x round scores, judge totals, media score differences), so queries across the whole corpus
+# are vectorized instead of looping over Python objects. Names are kept once in a string table.
+class DecisionCorpus:
+    def __init__(self, capacity=256):
+        self._lock = threading.Lock()
+        self.size = 0
+        self.num_media = 0
+        # Set when the arrays are views into a memory-mapped corpus file
+        self._mmap = None
+        self.mtime = None
+
+        # String table: names, fight results and event info are stored as int ids
+        self.strings = _StringTable()
+        # Row of each decision, keyed by decision id (the number in decision/7244/fight). Rows loaded from a
+        # corpus file are found by binary search in index_ids/index_rows instead.
+        self.rows = {}
+        self.index_ids = np.zeros(0, dtype=np.int32)
+        self.index_rows = np.zeros(0, dtype=np.int32)
+        # Inverted index of judges: normalized judge name -> list of (row, judge slot) of their scorecards.
+        # Built on first use.
+        self._judge_index = None
+
+        self.decision_ids = np.zeros(capacity, dtype=np.int32)
+        self.result_ids = np.full(capacity, -1, dtype=np.int32)
+        self.event_ids = np.full(capacity, -1, dtype=np.int32)
+        self.fighter_ids = np.full((capacity, 2), -1, dtype=np.int32)
+        self.judge_ids = np.full((capacity, MAX_JUDGES), -1, dtype=np.int32)
+        self.num_judges = np.zeros(capacity, dtype=np.int8)
+        self.num_rounds = np.zeros(capacity, dtype=np.int8)
+        # fight x judge x round x fighter. -1 where there is no score.
+        self.round_scores = np.full((capacity, MAX_JUDGES, MAX_ROUNDS, 2), -1, dtype=np.int16)
+        self.totals = np.full((capacity, MAX_JUDGES, 2), -1, dtype=np.int16)
+        # Fighter 1, fighter 2 and draw votes. -1 if there are no fan scores.
+        self.fan_votes = np.full((capacity, 3), -1, dtype=np.int32)
+
+        # Media scores of fight i are media_scores[media_offsets[i]:media_offsets[i+1]], in scorecard column
+        # order (fighter 1 score first)
+        self.media_offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.media_scores = np.zeros((capacity * 16, 2), dtype=np.int16)
+        self.media_picks = np.zeros(capacity * 16, dtype=np.int8)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, url):
+        return self._get_row(get_decision_id(url)) is not None
+
+    # Open a corpus file written by save(). The arrays are read straight out of the memory-mapped file, so
+    # processes opening the same file share its pages through the OS cache and there's nothing to load.
+    @classmethod
+    def open(cls, path) -> 'DecisionCorpus':
+        corpus = cls(capacity=0)
+        with open(path, 'rb') as f:
+            corpus._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            corpus.mtime = os.fstat(f.fileno()).st_mtime
+
+        magic, num_fights, num_media, num_strings, num_string_bytes = _HEADER.unpack_from(corpus._mmap, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError('{} is not a decision corpus file'.format(path))
+
+        arrays = {}
+        offset = _HEADER.size
+        for name, dtype, get_shape in _FILE_ARRAYS:
+            shape = get_shape(num_fights, num_media, num_strings, num_string_bytes)
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(corpus._mmap, dtype=dtype, count=count, offset=offset).reshape(shape)
+            offset = _align(offset + count * np.dtype(dtype).itemsize)
+
+        for name in _FIGHT_ARRAYS + ('media_offsets', 'media_scores', 'media_picks', 'index_ids', 'index_rows'):
+            setattr(corpus, name, arrays[name])
+        corpus.strings = _StringTable(arrays['string_offsets'], arrays['string_bytes'])
+        corpus.size = num_fights
+        corpus.num_media = num_media
+        return corpus
+
+    # Write the corpus to a file that open() can memory-map. The file is replaced atomically, so processes
+    # that have the old file mapped keep reading a consistent copy.
+    def save(self, path):
+        with self._lock:
+            size = self.size
+            order = np.argsort(self.decision_ids[:size], kind='stable')
+            string_offsets, string_bytes = self.strings.to_arrays()
+            arrays = {
+                'index_ids': self.decision_ids[:size][order],
+                'index_rows': order,
+                'media_offsets': self.media_offsets[:size + 1],
+                'media_scores': self.media_scores[:self.num_media],
+                'media_picks': self.media_picks[:self.num_media],
+                'string_offsets': string_offsets,
+                'string_bytes': string_bytes,
+            }
+            for name in _FIGHT_ARRAYS:
+                arrays[name] = getattr(self, name)[:size]
+
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(FILE_MAGIC, size, self.num_media, len(self.strings), len(string_bytes)))
+                offset = _HEADER.size
+                for name, dtype, get_shape in _FILE_ARRAYS:
+                    data = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+                    f.write(data)
+                    padding = _align(offset + len(data)) - offset - len(data)
+                    f.write(b'\0' * padding)
+                    offset += len(data) + padding
+            os.replace(tmp_path, path)
+
+    # Add a parsed fight (the tuple built by fight_finder) to the corpus. Returns the row, or None if
+    # the scorecards couldn't be converted to numbers.
+    def add_fight(self, url, fight) -> Optional[int]:
+        decision_id = get_decision_id(url)
+        if decision_id is None:
+            return None
+
+        score_tables, fight_result, media_scores, event_info, fan_scores = fight
+        try:
+            round_scores, totals, num_rounds = _get_score_arrays(score_tables)
+            media, picks = _get_media_arrays(media_scores, score_tables)
+        except (ValueError, IndexError, TypeError):
+            logger.exception('Could not convert scores to numbers from url {}'.format(url))
+            return None
+
+        with self._lock:
+            self._ensure_writable()
+            row = self._get_row(decision_id)
+            if row is not None:
+                # Scorecards never change once posted, only the fan scores do
+                self.fan_votes[row] = _get_fan_votes(fan_scores)
+                return row
+
+            row = self.size
+            self._ensure_capacity(row + 1, self.num_media + len(media))
+            self.decision_ids[row] = decision_id
+            self.result_ids[row] = self._get_string_id(fight_result)
+            self.event_ids[row] = self._get_string_id(event_info)
+            self.fighter_ids[row] = [self._get_string_id(score_tables[0][1][0][1]),
+                                     self._get_string_id(score_tables[0][1][0][2])]
+            num_judges = min(len(score_tables), MAX_JUDGES)
+            self.judge_ids[row, :num_judges] = [self._get_string_id(judge) for judge, table in
+                                                score_tables[:num_judges]]
+            self.num_judges[row] = num_judges
+            self.num_rounds[row] = num_rounds
+            self.round_scores[row] = round_scores
+            self.totals[row] = totals
+            self.fan_votes[row] = _get_fan_votes(fan_scores)
+
+            start = self.num_media
+            self.media_scores[start:start + len(media)] = media
+            self.media_picks[start:start + len(media)] = picks
+            self.num_media += len(media)
+            self.media_offsets[row + 1] = self.num_media
+
+            self.rows[decision_id] = row
+            self.size += 1
+            if self._judge_index is not None:
+                self._index_judges(row)
+            return row
+
+    # Rebuild the fight info tuple of a stored decision, for when the decision page can't be fetched.
+    # Returns None if the decision isn't in the corpus.
+    def get_fight(self, url) -> Optional[tuple]:
+        with self._lock:
+            row = self._get_row(get_decision_id(url))
+            if row is None:
+                return None
+            fighter_1, fighter_2 = (self.strings[i] for i in self.fighter_ids[row])
+            judges = [self.get_string(i) for i in self.judge_ids[row, :self.num_judges[row]]]
+            round_scores = self.round_scores[row].tolist()
+            totals = self.totals[row].tolist()
+            num_rounds = int(self.num_rounds[row])
+            start, end = self.media_offsets[row], self.media_offsets[row + 1]
+            media = self.media_scores[start:end].tolist()
+            picks = self.media_picks[start:end].tolist()
+            fan_votes = self.fan_votes[row].tolist()
+            fight_result = self.get_string(self.result_ids[row])
+            event_info = self.get_string(self.event_ids[row])
+
+        score_tables = []
+        for slot, judge in enumerate(judges):
+            rows = [['ROUND', fighter_1, fighter_2]]
+            for k in range(num_rounds):
+                if round_scores[slot][k][0] >= 0:
+                    rows.append([str(k + 1), str(round_scores[slot][k][0]), str(round_scores[slot][k][1])])
+            rows.append(['TOTAL', str(totals[slot][0]), str(totals[slot][1])])
+            score_tables.append((judge or 'Unknown Judge', rows))
+
+        # The site writes media scores winner first, and media picks that weren't understood are left out
+        media_scores = []
+        for score, pick in zip(media, picks):
+            if pick == PICK_FIGHTER_2:
+                media_scores.append(('{}-{}'.format(score[1], score[0]), fighter_2))
+            elif pick == PICK_FIGHTER_1:
+                media_scores.append(('{}-{}'.format(score[0], score[1]), fighter_1))
+            elif pick == PICK_DRAW:
+                media_scores.append(('{}-{}'.format(score[0], score[1]), 'DRAW'))
+        fan_scores = None
+        if fan_votes[0] >= 0:
+            fan_scores = [[fighter_1, fan_votes[0]], [fighter_2, fan_votes[1]], ['Draw', fan_votes[2]]]
+        return score_tables, fight_result, media_scores, event_info, fan_scores
+
+    # Rows of fights whose result names every one of the given fighters (ex. ["diaz", "mcgregor"])
+    def find_fight_rows(self, fighters) -> List[int]:
+        patterns = [re.compile(r'(^|\W)' + re.escape(_normalize(fighter)) + r'($|\W)') for fighter in fighters]
+        with self._lock:
+            result_ids = self.result_ids[:self.size].copy()
+            matching_ids = [i for i in np.unique(result_ids) if i >= 0 and
+                            all(pattern.search(_normalize(self.strings[i])) for pattern in patterns)]
+        return np.flatnonzero(np.isin(result_ids, matching_ids)).tolist()
+
+    def update_fan_scores(self, url, fan_scores):
+        with self._lock:
+            row = self._get_row(get_decision_id(url))
+            if row is not None:
+                self._ensure_writable()
+                self.fan_votes[row] = _get_fan_votes(fan_scores)
+
+    # Scoring stats of a judge from every scorecard in the corpus. Returns None if the judge isn't known.
+    def judge_stats(self, judge) -> Optional[dict]:
+        with self._lock:
+            key = self._find_judge_key(judge)
+            if key is None:
+                return None
+            scorecards = np.array(self._judge_index[key], dtype=np.int64)
+            rows, slots = scorecards[:, 0], scorecards[:, 1]
+            name = self.strings[self.judge_ids[rows[0], slots[0]]]
+            totals = self.totals[rows].astype(np.int32)
+            num_judges = self.num_judges[rows]
+            counts = np.diff(self.media_offsets[:self.size + 1])[rows]
+            starts = self.media_offsets[rows]
+            media_known = self.media_picks[:self.num_media] != PICK_UNKNOWN
+            pick_signs = self.media_pick_signs()
+
+        # Each judge's pick per fight: +1 for fighter 1, -1 for fighter 2, 0 for a draw
+        picks = np.sign(totals[:, :, 0] - totals[:, :, 1])
+        own_picks = picks[np.arange(len(rows)), slots]
+        other_slots = (slots[:, None] + np.array([1, 2])) % MAX_JUDGES
+        other_picks = np.take_along_axis(picks, other_slots, axis=1)
+        dissents = (num_judges == MAX_JUDGES) & (own_picks != other_picks[:, 0]) & (own_picks != other_picks[:, 1])
+
+        # Media consensus per fight is the majority of known media picks
+        media_fight = np.repeat(np.arange(len(rows)), counts)
+        # Position of each media score within its fight, added to where that fight's media scores start
+        position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        media_index = np.repeat(starts, counts) + position
+        media_picks = np.bincount(media_fight, weights=pick_signs[media_index], minlength=len(rows))
+        has_media = np.bincount(media_fight, weights=media_known[media_index], minlength=len(rows)) > 0
+        media_agreements = has_media & (np.sign(media_picks) == own_picks)
+
+        return {
+            'judge': name,
+            'scorecards': len(rows),
+            'dissents': int(dissents.sum()),
+            'media_fights': int(has_media.sum()),
+            'media_agreements': int(media_agreements.sum()),
+        }
+
+    def get_string(self, string_id) -> Optional[str]:
+        if string_id < 0:
+            return None
+        return self.strings[string_id]
+
+    # Per fight: +1 if the judges' majority went to fighter 1, -1 if to fighter 2, 0 for a draw
+    def official_winners(self) -> np.ndarray:
+        totals = self.totals[:self.size].astype(np.int32)
+        judge_diff = totals[:, :, 0] - totals[:, :, 1]
+        # Missing judges have totals of -1/-1, so they count as neither
+        return np.sign(np.sign(judge_diff).sum(axis=1))
+
+    # Per media scorecard: fighter 1 score minus fighter 2 score
+    def media_diffs(self) -> np.ndarray:
+        media = self.media_scores[:self.num_media].astype(np.int32)
+        return media[:, 0] - media[:, 1]
+
+    # Per media scorecard: +1 if it went to fighter 1, -1 if to fighter 2, 0 for a draw or an unknown pick
+    def media_pick_signs(self) -> np.ndarray:
+        return _PICK_SIGNS[self.media_picks[:self.num_media]]
+
+    # Per fight: (number of media scores with a known pick, number of those that disagree with the official
+    # result, mean score difference)
+    def media_disagreement(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            size = self.size
+            media_fight = np.repeat(np.arange(size), np.diff(self.media_offsets[:size + 1]))
+            known = self.media_picks[:self.num_media] != PICK_UNKNOWN
+            pick_signs = self.media_pick_signs()
+            media_diffs = self.media_diffs()
+            official = self.official_winners()
+
+        counts = np.bincount(media_fight, weights=known, minlength=size)
+        dissent = known & (pick_signs != official[media_fight])
+        dissent_counts = np.bincount(media_fight, weights=dissent, minlength=size)
+        diff_sums = np.bincount(media_fight, weights=media_diffs * known, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_diffs = diff_sums / counts
+        return counts, dissent_counts, mean_diffs
+
+    # Fights where the most media members scored it differently than the judges. Returns a list of
+    # (row, media dissent count, media score count), biggest robbery first.
+    def biggest_robberies(self, count=10, min_media=5, rows=None) -> List[Tuple[int, int, int]]:
+        counts, dissent_counts, mean_diffs = self.media_disagreement()
+        candidates = np.arange(len(counts)) if rows is None else np.asarray(rows, dtype=np.int64)
+        candidates = candidates[counts[candidates] >= min_media]
+        if len(candidates) == 0:
+            return []
+
+        dissent_share = dissent_counts[candidates] / counts[candidates]
+        # Sort by share of dissenting media, then by how lopsided the media scores were
+        order = np.lexsort((-np.abs(mean_diffs[candidates]), -dissent_share))[:count]
+        return [(int(candidates[i]), int(dissent_counts[candidates[i]]), int(counts[candidates[i]]))
+                for i in order]
+
+    # Rows of fights from events whose name contains event_name (ex. "ufc 202")
+    def find_event_rows(self, event_name) -> List[int]:
+        # Whole words only, so "ufc 20" doesn't match "ufc 202"
+        pattern = re.compile(r'(^|\W)' + re.escape(_normalize(event_name)) + r'($|\W)')
+        with self._lock:
+            event_ids = self.event_ids[:self.size].copy()
+            matching_ids = [i for i in np.unique(event_ids) if i >= 0 and pattern.search(_normalize(self.strings[i]))]
+        return np.flatnonzero(np.isin(event_ids, matching_ids)).tolist()
+
+    # Disagreement ranking within a single event
+    def event_disagreements(self, event_name, count=10, min_media=1) -> List[Tuple[int, int, int]]:
+        rows = self.find_event_rows(event_name)
+        if not rows:
+            return []
+        return self.biggest_robberies(count, min_media, rows)
+
+    def _get_row(self, decision_id) -> Optional[int]:
+        row = self.rows.get(decision_id)
+        if row is None and len(self.index_ids):
+            i = np.searchsorted(self.index_ids, decision_id)
+            if i < len(self.index_ids) and self.index_ids[i] == decision_id:
+                row = int(self.index_rows[i])
+        return row
+
+    def _index_judges(self, row):
+        for slot in range(self.num_judges[row]):
+            judge_id = self.judge_ids[row, slot]
+            if judge_id >= 0:
+                self._judge_index.setdefault(_normalize(self.strings[judge_id]), []).append((row, slot))
+
+    # Exact name first, then a partial name like "cleary". The judge with the most scorecards wins ties.
+    def _find_judge_key(self, judge):
+        if self._judge_index is None:
+            self._judge_index = {}
+            for row in range(self.size):
+                self._index_judges(row)
+
+        judge = _normalize(judge)
+        if judge in self._judge_index:
+            return judge
+        pattern = re.compile(r'(^|\W)' + re.escape(judge) + r'($|\W)')
+        matches = [key for key in self._judge_index if pattern.search(key)]
+        if not matches:
+            return None
+        return max(matches, key=lambda key: len(self._judge_index[key]))
+
+    def _get_string_id(self, string) -> int:
+        if string is None:
+            return -1
+        return self.strings.get_id(string)
+
+    # Arrays mapped from a corpus file are read-only, so copy them into memory before the first change
+    def _ensure_writable(self):
+        if self._mmap is None:
+            return
+        for name in _FIGHT_ARRAYS + ('media_offsets', 'media_scores', 'media_picks'):
+            setattr(self, name, getattr(self, name).copy())
+        # Rows added from now on go in the rows dict, rows from the file are still found through the index
+        self.index_ids = self.index_ids.copy()
+        self.index_rows = self.index_rows.copy()
+        self.strings.detach()
+        self._mmap = None
+
+    # Grow the arrays by doubling so that adding fights one at a time stays cheap
+    def _ensure_capacity(self, num_fights, num_media):
+        capacity = len(self.decision_ids)
+        if num_fights > capacity:
+            new_capacity = max(num_fights, capacity * 2)
+            for name in ('decision_ids', 'result_ids', 'event_ids', 'fighter_ids', 'judge_ids', 'num_judges',
+                         'num_rounds', 'round_scores', 'totals', 'fan_votes'):
+                setattr(self, name, _grow(getattr(self, name), new_capacity))
+            self.media_offsets = _grow(self.media_offsets, new_capacity + 1, fill=0)
+
+        media_capacity = len(self.media_picks)
+        if num_media > media_capacity:
+            new_capacity = max(num_media, media_capacity * 2)
+            self.media_scores = _grow(self.media_scores, new_capacity, fill=0)
+            self.media_picks = _grow(self.media_picks, new_capacity, fill=0)
+
+
+# Open the corpus file at path, or start an empty corpus if there isn't a usable one
+def open_corpus(path) -> DecisionCorpus:
+    try:
+        return DecisionCorpus.open(path)
+    except FileNotFoundError:
+        logger.info('No corpus file \'{}\' yet, starting with an empty corpus.'.format(path))
+    except (ValueError, OSError, struct.error):
+        logger.exception('Could not open corpus file \'{}\', starting with an empty corpus.'.format(path))
+    return DecisionCorpus()
+
+
+# Strings stored once and referred to by id. Strings from a corpus file are decoded from the mapped
+# bytes when accessed, and the lookup from string to id is only built once a new string is added.
+class _StringTable:
+    def __init__(self, offsets=None, data=None):
+        self._offsets = offsets
+        self._data = data
+        self._num_mapped = 0 if offsets is None else len(offsets) - 1
+        self._strings = []
+        self._ids = None
+
+    def __len__(self):
+        return self._num_mapped + len(self._strings)
+
+    def __getitem__(self, string_id):
+        if string_id < self._num_mapped:
+            return bytes(self._data[self._offsets[string_id]:self._offsets[string_id + 1]]).decode('utf-8')
+        return self._strings[string_id - self._num_mapped]
+
+    def get_id(self, string) -> int:
+        if self._ids is None:
+            self._ids = {self[i]: i for i in range(len(self))}
+        string_id = self._ids.get(string)
+        if string_id is None:
+            string_id = len(self)
+            self._strings.append(string)
+            self._ids[string] = string_id
+        return string_id
+
+    # Stop reading from the mapped file by decoding all of its strings
+    def detach(self):
+        self._strings = [self[i] for i in range(len(self))]
+        self._offsets = None
+        self._data = None
+        self._num_mapped = 0
+
+    def to_arrays(self):
+        encoded = [self[i].encode('utf-8') for i in range(len(self))]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _grow(array, new_length, fill=-1):
+    new_array = np.full((new_length,) + array.shape[1:], fill, dtype=array.dtype)
+    new_array[:len(array)] = array
+    return new_array
+
+
+# Decision urls look like http://mmadecisions.com/decision/7244/fight
+def get_decision_id(url) -> Optional[int]:
+    if not url:
+        return None
+    match = re.search(r'decision/(\d+)', url)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def _normalize(text):
+    return ' '.join(unidecode(text).lower().split())
+
+
+def _get_score_arrays(score_tables):
+    round_scores = np.full((MAX_JUDGES, MAX_ROUNDS, 2), -1, dtype=np.int16)
+    totals = np.full((MAX_JUDGES, 2), -1, dtype=np.int16)
+    num_rounds = 0
+    for i, (judge, table) in enumerate(score_tables[:MAX_JUDGES]):
+        # First row is the fighter names and last row is the total
+        rounds = table[1:-1][:MAX_ROUNDS]
+        for k, row in enumerate(rounds):
+            round_scores[i, k] = [int(row[1]), int(row[2])]
+        totals[i] = [int(table[-1][1]), int(table[-1][2])]
+        num_rounds = max(num_rounds, len(rounds))
+    return round_scores, totals, num_rounds
+
+
+# Media scores look like ('48-47', 'McGregor'), with the score of the fighter they picked first. They're stored
+# in scorecard column order.
+def _get_media_arrays(media_scores, score_tables):
+    if not media_scores:
+        return np.zeros((0, 2), dtype=np.int16), np.zeros(0, dtype=np.int8)
+
+    fighter_1, fighter_2 = score_tables[0][1][0][1], score_tables[0][1][0][2]
+    media = np.zeros((len(media_scores), 2), dtype=np.int16)
+    picks = np.zeros(len(media_scores), dtype=np.int8)
+    for i, (score, fighter) in enumerate(media_scores):
+        score_list = score.split('-')
+        picks[i] = _get_media_pick(fighter, fighter_1, fighter_2)
+        if picks[i] == PICK_FIGHTER_2:
+            media[i] = [int(score_list[1]), int(score_list[0])]
+        else:
+            media[i] = [int(score_list[0]), int(score_list[1])]
+    return media, picks
+
+
+# Media members name their pick by full or last name (ex. "Diaz" for "Nate Diaz"), so the fighter sharing the
+# most words with it is the pick
+def _get_media_pick(fighter, fighter_1, fighter_2):
+    if fighter.upper() == 'DRAW':
+        return PICK_DRAW
+    words = set(_normalize(fighter).split())
+    overlap_1 = len(words & set(_normalize(fighter_1).split()))
+    overlap_2 = len(words & set(_normalize(fighter_2).split()))
+    if overlap_1 > overlap_2:
+        return PICK_FIGHTER_1
+    if overlap_2 > overlap_1:
+        return PICK_FIGHTER_2
+    return PICK_UNKNOWN
+
+
+def _get_fan_votes(fan_scores):
+    if not fan_scores or len(fan_scores) != 3:
+        return [-1, -1, -1]
+    return [fan_scores[0][1], fan_scores[1][1], fan_scores[2][1]]
@@ -1,5 +1,8 @@
+import os
 import sys
+import atexit
 from bs4 import BeautifulSoup
+from lxml import etree
 from unidecode import unidecode
 from urllib.request import urlopen
 import urllib.error
@@ -7,9 +10,17 @@ import requests
 from pprint import pprint
 from datetime import datetime
 import logging
+import threading
+import time
 import yaml
 import json
-from typing import Optional, List, Union
+import copy
+import re
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Union, Tuple, Dict
+
+import decision_corpus
 
 # Set logging level to INFO for status output, CRITICAL for no output
 logging.basicConfig(stream=sys.stdout, level=logging.WARNING)
@@ -20,22 +31,532 @@ with open('config.yaml', 'r') as cfg_file:
     cfg = yaml.load(cfg_file)
 home_url = cfg['home_url']
 
+# Recent lookups that found nothing (fights that ended in a finish, jokes, typos), mapped to expiry time
+_negative_cache = {}
+_negative_cache_lock = threading.Lock()
+
+# Fetches currently in progress, keyed by search term or decision url, so concurrent callers share one fetch
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+# Search results warmed ahead of demand by prefetch_fights(), keyed by search term: (expiry time, fight entries)
+_search_cache = {}
+_search_cache_lock = threading.Lock()
+
+# Parsed decision pages, keyed by url: [fight info tuple, time fan scores were last fetched]
+_fight_cache = OrderedDict()
+_fight_cache_lock = threading.Lock()
+
+# Every decision parsed so far, kept as NumPy arrays for corpus-wide queries. Shared between bot
+# processes through a memory-mapped file. Only the writer process (started with --corpus-writer or
+# DECISION_CORPUS_WRITER=1) adds to it and saves it. The others read the mapped file as is, and keep the
+# decisions they parse themselves in _fight_cache until the writer has them too.
+corpus = decision_corpus.open_corpus(cfg['corpus_file'])
+corpus_writer = os.environ.get('DECISION_CORPUS_WRITER') == '1'
+# Set when the writer has changes that aren't saved yet
+_corpus_dirty = False
+_corpus_save_lock = threading.Lock()
+
+# Local dictionary of fighter names, used to rank guess-mode name splits before searching.
+# Filled from the corpus on first use, then from every fighter and fight the bot comes across.
+_known_full_names = set()
+_known_name_fragments = set()
+_known_names_loaded = False
+
+# Counts of site health events (circuit breaker trips and recoveries, answers served from stored decisions,
+# page layout switches, hedged requests). Reported in the bot's query log records.
+metrics = Counter()
+
+# mmadecisions.com sometimes serves an alternate layout of its decision pages, where the score and media
+# tables have different attributes. Sections of a page, with their table attributes in each layout:
+LAYOUT_PRIMARY = 'primary'
+LAYOUT_BACKUP = 'backup'
+_SCORE_TABLE_ATTRS = {'style': 'border-spacing: 1px; width: 100%'}
+_BACKUP_SCORE_TABLE_ATTRS = {'cellspacing': '1', 'width': '100%'}
+_MEDIA_TABLE_ATTRS = {'style': 'border-spacing: 0px; width: 100%'}
+_BACKUP_MEDIA_TABLE_ATTRS = {'cellspacing': '2', 'width': '100%'}
+_TABLE_LAYOUTS = (
+    ('score_tables', LAYOUT_PRIMARY, _SCORE_TABLE_ATTRS),
+    ('score_tables', LAYOUT_BACKUP, _BACKUP_SCORE_TABLE_ATTRS),
+    ('media', LAYOUT_PRIMARY, _MEDIA_TABLE_ATTRS),
+    ('media', LAYOUT_BACKUP, _BACKUP_MEDIA_TABLE_ATTRS),
+)
+# Layout the site is currently serving, per section. Pages whose fingerprint doesn't show a section's
+# layout are parsed with this one.
+_site_layout = {'score_tables': LAYOUT_PRIMARY, 'media': LAYOUT_PRIMARY}
+_site_layout_lock = threading.Lock()
+# Layout switches not yet reported by pop_layout_switches(), as dicts of section, old and new layout, and url
+_layout_switches = []
+
+# Worker threads for background refreshes and concurrent page fetches
+_executor = ThreadPoolExecutor(max_workers=cfg['fetch_workers'], thread_name_prefix='fight_finder')
+
+# Hedged requests: recent response times of site requests, and times hedges were sent in the last minute.
+# Requests run on their own threads, so fetches already running on _executor never wait on it.
+_latencies = deque(maxlen=cfg['hedge_sample_size'])
+_hedge_times = deque()
+_hedge_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=cfg['fetch_workers'] * 2, thread_name_prefix='fight_finder_hedge')
+
+
+# Swap in a reloaded config while the bot keeps running. The worker thread count and corpus file
+# only take effect on restart.
+def apply_config(new_cfg):
+    global home_url
+    # Update keys in place rather than replacing cfg, so code holding a reference sees every key at all times
+    cfg.update(new_cfg)
+    home_url = cfg['home_url']
+
 
 def get_fight_info(fighter_1, fighter_2):
     if fighter_1 and fighter_2 and len(fighter_1) > 1 and len(fighter_2) > 1:
-        fight_urls = _get_fight_urls(fighter_1, fighter_2)
+        pair_key = _get_pair_key(fighter_1, fighter_2)
+        if _is_known_miss(pair_key):
+            logger.info('Fighter pair {} recently failed, skipping search.'.format(pair_key))
+            return None
+        try:
+            fight_urls = _get_fight_urls(fighter_1, fighter_2)
+        except (SiteUnavailableError, OSError):
+            _lookup_state.site_failed = True
+            logger.warning('mmadecisions.com is unavailable, looking for {} vs {} in stored decisions...'
+                           .format(fighter_1, fighter_2))
+            return _get_fight_info_from_fight_page(_get_stored_fight_urls([fighter_1, fighter_2])[:6])
+        if not fight_urls:
+            _record_miss(pair_key)
         return _get_fight_info_from_fight_page(fight_urls)
     return None
 
 
-# There could be multiple fights due to rematches
-def _get_fight_urls(fighter_1, fighter_2):
-    # First, check if there's a fight url match for each search term
-    fight_list_1 = _get_fight_url_list(unidecode(fighter_1).replace(' ', '+'))
-    fight_list_2 = _get_fight_url_list(unidecode(fighter_2).replace(' ', '+'))
+# Look up several fights at once, ex. for a comment asking for "edgar vs maynard, lawler vs hendricks".
+# Every distinct fighter is searched once, the searches run concurrently, and then every decision page
+# needed by any of the fights is fetched concurrently. Queries that don't name two fighters go through
+# get_fight_info_from_input one at a time. Returns a (fight info, fight number) tuple per query, in order.
+def get_fight_info_batch(input_fights):
+    results = [(None, -1)] * len(input_fights)
+    pairs = {}
+    for i, input_fight in enumerate(input_fights):
+        fighter_1, fighter_2, fight_num = get_fighters_from_input(input_fight)
+        if fighter_1 and fighter_2 and len(fighter_1) > 1 and len(fighter_2) > 1:
+            if _is_known_miss(_get_query_key(input_fight)) or _is_known_miss(_get_pair_key(fighter_1, fighter_2)):
+                logger.info('Query \'{}\' recently failed, skipping search.'.format(input_fight))
+                results[i] = (None, fight_num)
+            else:
+                pairs[i] = (fighter_1, fighter_2, fight_num)
+        else:
+            results[i] = get_fight_info_from_input(input_fight)
+
+    try:
+        fight_urls = _get_fight_urls_batch({i: pair[:2] for i, pair in pairs.items()})
+    except (SiteUnavailableError, OSError):
+        # Let each fight fall back to stored decisions on its own
+        logger.warning('Could not search for batch {}, looking fights up one at a time...'.format(input_fights))
+        for i in pairs:
+            results[i] = get_fight_info_from_input(input_fights[i])
+        return results
+
+    # All decision pages are fetched once each, at the same time
+    all_urls = list(OrderedDict.fromkeys(url for urls in fight_urls.values() for url in urls))
+    fights = dict(zip(all_urls, _executor.map(_get_fight, all_urls)))
+
+    for i, (fighter_1, fighter_2, fight_num) in pairs.items():
+        fight_info = [fights[url] for url in fight_urls[i]]
+        if not fight_info or any(fight is None for fight in fight_info):
+            if not fight_urls[i]:
+                _record_miss(_get_pair_key(fighter_1, fighter_2))
+                _record_miss(_get_query_key(input_fights[i]))
+            results[i] = (None, fight_num)
+        else:
+            # Replies modify fight info in place, so fights asked for twice don't share it
+            results[i] = (copy.deepcopy(fight_info), fight_num)
+    return results
+
+
+# Fight urls for each {index: (fighter 1, fighter 2)}. Searches for the same fighter are only done once.
+def _get_fight_urls_batch(pairs):
+    if cfg['single_search']:
+        # Search the more specific name of each pair first, like _get_fight_urls
+        pairs = {i: (pair if _get_name_specificity(pair[0]) >= _get_name_specificity(pair[1]) else pair[::-1])
+                 for i, pair in pairs.items()}
+        first_fighters = [pair[0] for pair in pairs.values()]
+    else:
+        first_fighters = [fighter for pair in pairs.values() for fighter in pair]
+    fight_entries = _search_batch(first_fighters, {})
+
+    fight_urls = {}
+    for i, (fighter_1, fighter_2) in pairs.items():
+        if fight_entries[_get_search_term(fighter_1)] is None:
+            fight_urls[i] = []
+        elif cfg['single_search']:
+            fight_urls[i] = _match_opponent(fight_entries[_get_search_term(fighter_1)], fighter_2)
+
+    # Pairs that need both searches
+    unresolved = [i for i in pairs if fight_urls.get(i) is None]
+    fight_entries = _search_batch([pairs[i][1] for i in unresolved], fight_entries)
+    for i in unresolved:
+        fight_list_1, fight_list_2 = (_get_entry_urls(fight_entries[_get_search_term(fighter)]) for fighter in pairs[i])
+        fight_urls[i] = _find_fight_url_matches(fight_list_1, fight_list_2)
+    return fight_urls
+
+
+# Search for each fighter not in fight_entries yet, concurrently. Returns fight_entries with the new results.
+def _search_batch(fighters, fight_entries):
+    terms = [term for term in OrderedDict.fromkeys(_get_search_term(fighter) for fighter in fighters)
+             if term not in fight_entries]
+    fight_entries = dict(fight_entries)
+    fight_entries.update(zip(terms, _executor.map(_get_fight_entry_list, terms)))
+    return fight_entries
+
+
+def _get_search_term(fighter):
+    return unidecode(fighter).replace(' ', '+')
+
+
+# Decision urls of (url, opponent name) fight entries
+def _get_entry_urls(fight_entries):
+    if fight_entries is None:
+        return None
+    return [url for url, opponent in fight_entries]
+
+
+# Normalize a query so that trivial differences (case, accents, spacing) share a cache entry
+def _normalize_query(text):
+    return ' '.join(unidecode(text).lower().split())
+
+
+def _get_query_key(input_fight):
+    return 'query', _normalize_query(input_fight)
+
+
+# Fighter order doesn't matter: "a vs b" and "b vs a" are the same miss
+def _get_pair_key(fighter_1, fighter_2):
+    return ('pair',) + tuple(sorted((_normalize_query(fighter_1), _normalize_query(fighter_2))))
+
+
+def _is_known_miss(key):
+    with _negative_cache_lock:
+        expiry = _negative_cache.get(key)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del _negative_cache[key]
+            return False
+        return True
+
+
+def _record_miss(key):
+    now = time.monotonic()
+    with _negative_cache_lock:
+        # Drop expired entries every so often so the cache can't grow without bound
+        if len(_negative_cache) >= cfg['negative_cache_size']:
+            for expired_key in [k for k, expiry in _negative_cache.items() if expiry < now]:
+                del _negative_cache[expired_key]
+            if len(_negative_cache) >= cfg['negative_cache_size']:
+                _negative_cache.clear()
+        _negative_cache[key] = now + cfg['negative_cache_ttl']
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# Run fn(*args) once per key at a time. Callers arriving while it runs wait for and share its result.
+def _singleflight(key, fn, *args):
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _InFlightCall()
+            _in_flight[key] = call
+        else:
+            call.waiters += 1
+
+    if not is_leader:
+        logger.info('Waiting on in-flight fetch for {}'.format(key))
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    try:
+        call.result = fn(*args)
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call.done.set()
+    # Replies modify fight info in place (rematch ordering, easter eggs), so each caller gets its own copy
+    if call.waiters:
+        return copy.deepcopy(call.result)
+    return call.result
+
+
+# Raised instead of contacting mmadecisions.com while the circuit breaker is open
+class SiteUnavailableError(Exception):
+    pass
+
+
+# Circuit breaker around all mmadecisions.com traffic. It trips (opens) when too many recent requests time
+# out or fail, and from then on requests fail fast with SiteUnavailableError instead of waiting on the site.
+# Once breaker_reset_timeout has passed it lets one probe request through (half-open): if the probe works
+# the breaker closes again, otherwise it stays open for another breaker_reset_timeout.
+class _CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._opened_at = 0
+        self._probing = False
+        # (time, succeeded) of requests within the last breaker_window seconds
+        self._outcomes = deque()
+
+    # Raise SiteUnavailableError unless a request may go to the site right now
+    def before_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= cfg['breaker_reset_timeout']:
+                logger.warning('Probing whether mmadecisions.com is back up...')
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            state = self.state
+        raise SiteUnavailableError('mmadecisions.com is unavailable (circuit breaker {})'.format(state))
+
+    def record_success(self):
+        with self._lock:
+            self._probing = False
+            if self.state != self.CLOSED:
+                logger.warning('mmadecisions.com is back up, closing circuit breaker.')
+                metrics['breaker_recoveries'] += 1
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            self._add_outcome(True)
+
+    def record_failure(self):
+        with self._lock:
+            self._probing = False
+            if self.state == self.HALF_OPEN:
+                self._trip()
+            elif self.state == self.CLOSED:
+                self._add_outcome(False)
+                failures = sum(1 for t, succeeded in self._outcomes if not succeeded)
+                if failures >= cfg['breaker_min_failures'] and \
+                        failures / len(self._outcomes) >= cfg['breaker_failure_rate']:
+                    self._trip()
+
+    # A request that never reached the site (ex. a bad url) says nothing about its health
+    def record_cancel(self):
+        with self._lock:
+            self._probing = False
+
+    def is_closed(self):
+        with self._lock:
+            return self.state == self.CLOSED
+
+    def _add_outcome(self, succeeded):
+        now = time.monotonic()
+        self._outcomes.append((now, succeeded))
+        while self._outcomes and self._outcomes[0][0] < now - cfg['breaker_window']:
+            self._outcomes.popleft()
+
+    def _trip(self):
+        logger.error('mmadecisions.com is failing, opening circuit breaker for {} seconds. Answering from stored '
+                     'decisions only until then.'.format(cfg['breaker_reset_timeout']))
+        metrics['breaker_trips'] += 1
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+
+_breaker = _CircuitBreaker()
+# Set when the current thread's lookup had to fall back to stored decisions, so its miss isn't cached
+_lookup_state = threading.local()
+
+
+# 'closed' while mmadecisions.com is up, 'open' or 'half-open' while only stored decisions are used
+def get_site_status():
+    return _breaker.state
+
+
+def get_metrics():
+    return dict(metrics)
+
+
+def pop_layout_switches():
+    with _site_layout_lock:
+        switches = list(_layout_switches)
+        del _layout_switches[:]
+    return switches
+
+
+# Every request to mmadecisions.com goes through here (or through _get_search_result_url), so that the
+# circuit breaker sees all site traffic and every request has a timeout
+def _open_url(url):
+    _breaker.before_request()
+    try:
+        # Don't double up on the single probe request while the breaker is half-open
+        if cfg['hedge_requests'] and _breaker.is_closed():
+            page = _hedged_urlopen(url)
+        else:
+            page = _timed_urlopen(url)
+    except urllib.error.HTTPError as e:
+        # The site answered, so only server errors count against it
+        if e.code >= 500:
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+        raise
+    except OSError:
+        # Timeouts, refused connections, DNS failures
+        _breaker.record_failure()
+        raise
+    except Exception:
+        _breaker.record_cancel()
+        raise
+    _breaker.record_success()
+    return page
+
+
+def _timed_urlopen(url):
+    start_time = time.monotonic()
+    page = urlopen(url, timeout=cfg['site_timeout'])
+    with _hedge_lock:
+        _latencies.append(time.monotonic() - start_time)
+    return page
+
+
+# Send a duplicate request if the site hasn't answered within the hedge_percentile of recent response times,
+# and use whichever answers first. Only pages are fetched this way, so sending a request twice is harmless.
+# At most hedge_budget_per_minute hedges are sent, so a slow site doesn't get twice the traffic.
+def _hedged_urlopen(url):
+    delay = _get_hedge_delay()
+    primary = _hedge_executor.submit(_timed_urlopen, url)
+    if delay is None:
+        return primary.result()
+    done, pending = wait([primary], timeout=delay)
+    if done or not _take_hedge_budget():
+        return primary.result()
+
+    logger.info('No answer from {} after {:.2f} seconds, sending hedged request'.format(url, delay))
+    metrics['hedged_requests'] += 1
+    hedge = _hedge_executor.submit(_timed_urlopen, url)
+    attempts = [primary, hedge]
+    while True:
+        done, pending = wait(attempts, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None or len(attempts) == 1:
+                attempts.remove(future)
+                # The other request can't be stopped once it's sent, so close its response when it arrives
+                for other in attempts:
+                    other.cancel()
+                    other.add_done_callback(_close_page)
+                if future is hedge and future.exception() is None:
+                    metrics['hedge_wins'] += 1
+                return future.result()
+            # Failed while the other request may still answer
+            attempts.remove(future)
+
+
+def _close_page(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+# The hedge_percentile of recent response times, or None until there are hedge_min_samples of them
+def _get_hedge_delay():
+    with _hedge_lock:
+        if len(_latencies) < cfg['hedge_min_samples']:
+            return None
+        latencies = sorted(_latencies)
+    delay = latencies[int(cfg['hedge_percentile'] / 100 * (len(latencies) - 1))]
+    return max(delay, cfg['hedge_min_delay'])
+
+
+def _take_hedge_budget():
+    now = time.monotonic()
+    with _hedge_lock:
+        while _hedge_times and _hedge_times[0] < now - 60:
+            _hedge_times.popleft()
+        if len(_hedge_times) >= cfg['hedge_budget_per_minute']:
+            return False
+        _hedge_times.append(now)
+        return True
+
+
+def _read_url(url):
+    page = _open_url(url)
+    try:
+        return page.read()
+    except OSError:
+        _breaker.record_failure()
+        raise
+    finally:
+        page.close()
+
+
+# There could be multiple fights due to rematches. search returns the fight entries of a search term.
+def _get_fight_urls(fighter_1, fighter_2, search=None):
+    search = search or _get_fight_entry_list
+    if not cfg['single_search']:
+        # Check if there's a fight url match for each search term
+        fight_list_1 = _get_entry_urls(search(_get_search_term(fighter_1)))
+        fight_list_2 = _get_entry_urls(search(_get_search_term(fighter_2)))
+        return _find_fight_url_matches(fight_list_1, fight_list_2)
+
+    # Search the more specific name first. Its fighter pages list every opponent, which is usually enough to
+    # find the fight without searching the other name at all.
+    if _get_name_specificity(fighter_2) > _get_name_specificity(fighter_1):
+        fighter_1, fighter_2 = fighter_2, fighter_1
+    fight_entries = search(_get_search_term(fighter_1))
+    if fight_entries is None:
+        return []
+    fight_urls = _match_opponent(fight_entries, fighter_2)
+    if fight_urls is not None:
+        return fight_urls
+    logger.info('Could not tell {}\'s opponent {} from their fights, searching for both...'
+                .format(fighter_1, fighter_2))
+    fight_list_1 = _get_entry_urls(fight_entries)
+    fight_list_2 = _get_entry_urls(search(_get_search_term(fighter_2)))
     return _find_fight_url_matches(fight_list_1, fight_list_2)
 
 
+# Longer names and names the bot already knows in full are less likely to match several fighters
+def _get_name_specificity(fighter):
+    name = _normalize_query(fighter)
+    return name in _known_full_names, len(name.split()), len(name)
+
+
+# Urls of the fights against opponent, from (url, opponent name) entries of the first fighter's pages.
+# Returns None if that can't be told from the entries alone: nothing matched, several different opponents
+# matched, or some opponent names are unknown.
+def _match_opponent(fight_entries, opponent):
+    words = _normalize_query(opponent).split()
+    if not words or any(not name for url, name in fight_entries):
+        return None
+    matches = [(url, name) for url, name in fight_entries if all(word in name.split() for word in words)]
+    if not matches or len(set(name for url, name in matches)) > 1:
+        return None
+
+    fight_urls = []
+    for url, name in matches:
+        if url not in fight_urls:
+            fight_urls.append(url)
+            if len(fight_urls) > 5:
+                logger.warning('Limiting number of fight url matches to 6.')
+                break
+    return fight_urls
+
+
 def _find_fight_url_matches(fight_list_1, fight_list_2):
     # Need to return a list of all matches, in case of rematches
     fight_urls = []
@@ -54,45 +575,127 @@ def _find_fight_url_matches(fight_list_1, fight_list_2):
     return fight_urls
 
 
-def _get_fight_url_list(fighter):
+# Fights found by searching for a fighter, as (decision url, opponent name) entries
+def _get_fight_entry_list(fighter):
+    with _search_cache_lock:
+        entry = _search_cache.get(fighter)
+    if entry is not None and entry[0] >= time.monotonic():
+        return copy.copy(entry[1])
+    return _singleflight(('search', fighter), _search_fight_entries, fighter)
+
+
+# Warm the caches for fights that are about to be asked about (ex. tonight's card): look the fights up again
+# the way a summon would, keep the search results for search_cache_ttl seconds, and fetch any of their
+# decisions that aren't cached yet. Recent misses for fights found this way are forgotten.
+# Returns {(fighter 1, fighter 2): fight urls}.
+def prefetch_fights(fighter_pairs):
+    found = {}
+    # Search results of this prefetch, so a fighter on several pairs is searched once
+    searched = {}
+    for fighter_1, fighter_2 in fighter_pairs:
+        fight_urls = _get_fight_urls(fighter_1, fighter_2, lambda fighter: _prefetch_search(fighter, searched))
+        if fight_urls:
+            _forget_misses(fighter_1, fighter_2)
+            list(_executor.map(_get_fight, fight_urls))
+        found[(fighter_1, fighter_2)] = fight_urls
+    return found
+
+
+# Search results younger than live_poll_interval seconds are reused, since a decision posted since then
+# would be found on the next poll anyway
+def _prefetch_search(fighter, searched):
+    if fighter not in searched:
+        now = time.monotonic()
+        with _search_cache_lock:
+            entry = _search_cache.get(fighter)
+        if entry is not None and entry[0] - cfg['search_cache_ttl'] > now - cfg['live_poll_interval']:
+            searched[fighter] = entry[1]
+        else:
+            searched[fighter] = _singleflight(('search', fighter), _search_fight_entries, fighter)
+            with _search_cache_lock:
+                # Drop expired entries so prefetches for past events don't pile up
+                for expired_key in [k for k, entry in _search_cache.items() if entry[0] < now]:
+                    del _search_cache[expired_key]
+                _search_cache[fighter] = (now + cfg['search_cache_ttl'], copy.copy(searched[fighter]))
+    return copy.copy(searched[fighter])
+
+
+# Forget recent misses of pair or query keys naming both fighters (by last name), ex. a summon for
+# "nunes vs spencer" made just before the decision was posted
+def _forget_misses(fighter_1, fighter_2):
+    last_names = [_normalize_query(fighter).split()[-1] for fighter in (fighter_1, fighter_2) if fighter.strip()]
+    with _negative_cache_lock:
+        for key in list(_negative_cache):
+            words = ' '.join(key[1:]).split()
+            if all(name in words for name in last_names):
+                logger.info('Forgetting recent miss {}'.format(key))
+                del _negative_cache[key]
+
+
+def _search_fight_entries(fighter):
     # Entering fighter as query on initial search page
-    query_url = cfg['search_url'] + fighter
+    url = _get_search_result_url(cfg['search_url'] + fighter)
+    if url is None:
+        return None
+
+    # If page redirects to a fighter url
+    if cfg['fighter_sub_url'] in url:
+        logger.info('I\'m on a fighter page. Retrieving my fights...')
+        return _get_fight_entries_from_fighter_page(url)
+    # If page redirects to a search url
+    elif cfg['search_sub_url'] in url:
+        logger.info('I\'m on a search page. Retrieving all fights, if any...')
+        return _get_fights_from_search_page(url)
+    # If page redirects to any other url
+    else:
+        logger.info('I\'m on an irrelevant page. Returning none...')
+        return None
+
+
+# The search page redirects straight to a fighter or event page when there is a single match
+def _get_search_result_url(query_url):
+    _breaker.before_request()
     try:
-        page = requests.get(query_url)
+        page = requests.get(query_url, timeout=cfg['site_timeout'])
         url = page.url
         # Currently there is a search functionality issue with mmadecisions.com
         url = url.replace('mmadecisions/fighter', 'fighter')
+    except (requests.Timeout, requests.ConnectionError):
+        # The site is slow or down, so retrying with urlopen() would only wait for it a second time
+        _breaker.record_failure()
+        raise
     except Exception:
         logger.exception('Could not open url {} with requests.get(), trying urlopen()...'.format(query_url))
+        # Let the urlopen() backup decide whether the site is failing
+        _breaker.record_cancel()
         # Use urlopen() as backup if requests.get() fails
         try:
-            page = urlopen(query_url)
+            page = _open_url(query_url)
             url = page.geturl()
+            page.close()
             url = url.replace('mmadecisions/fighter', 'fighter')
         except (urllib.error.HTTPError, UnicodeEncodeError):
             logger.exception('urlopen() failed as well')
             return None
-
-    # If page redirects to a fighter url
-    if cfg['fighter_sub_url'] in url:
-        logger.info('I\'m on a fighter page. Retrieving my fights...')
-        return _get_fights_from_fighter_page(url)
-    # If page redirects to a search url
-    elif cfg['search_sub_url'] in url:
-        logger.info('I\'m on a search page. Retrieving all fights, if any...')
-        return _get_fights_from_search_page(url)
-    # If page redirects to any other url
     else:
-        logger.info('I\'m on an irrelevant page. Returning none...')
-        return None
+        if page.status_code >= 500:
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+    return url
 
 
 def _get_fights_from_fighter_page(fighter_page_url):
-    # List of fight urls to be returned
+    return _get_entry_urls(_get_fight_entries_from_fighter_page(fighter_page_url))
+
+
+# (decision url, opponent name) of every decision on a fighter page
+def _get_fight_entries_from_fighter_page(fighter_page_url):
+    # List of fight entries to be returned
     list_of_fights = []
 
     # Opening page
-    soup = BeautifulSoup(urlopen(fighter_page_url).read(), "lxml")
+    soup = BeautifulSoup(_read_url(fighter_page_url), "lxml")
 
     # Getting the list of fights from the table
     table = soup.find('td', attrs={'valign': 'top', 'align': 'center', 'width': '505px'})
@@ -105,24 +708,48 @@ def _get_fights_from_fighter_page(fighter_page_url):
         if 'decision/' in url['href']:
             clean_url = _sanitize_url(url['href'])
             logger.info('\t\t' + clean_url)
-            list_of_fights.append(clean_url)
+            list_of_fights.append((clean_url, _get_opponent_name(url, fighter_page_url)))
 
     return list_of_fights
 
 
-def _get_fights_from_search_page(search_page_url):
-    # List of fight urls to be returned
-    list_of_fights = []
+# Opponent in a fight listed on a fighter page: the other fighter linked in the same row, or else the other
+# name in the decision link (ex. decision/7244/Nate-Diaz-vs-Conor-McGregor). Empty if it can't be told.
+def _get_opponent_name(decision_link, fighter_page_url):
+    fighter = _normalize_query(_get_name_from_fighter_url(fighter_page_url))
+    row = decision_link.find_parent('tr')
+    if row is not None:
+        for link in row.find_all('a', href=True):
+            name = _normalize_query(link.getText())
+            if link['href'].startswith('fighter/') and name and name != fighter:
+                return name
+
+    url_sections = decision_link['href'].split('/')
+    if len(url_sections) >= 3:
+        names = [_normalize_query(name.replace('-', ' ')) for name in url_sections[2].split('-vs-')]
+        opponents = [name for name in names if name != fighter]
+        if len(names) == 2 and len(opponents) == 1:
+            return opponents[0]
+    return ''
 
+
+def _open_search_page(search_page_url):
     try:
-        page = urlopen(search_page_url)
+        page = _read_url(search_page_url)
     except (urllib.error.HTTPError, UnicodeEncodeError):
         # Sometimes mmadecisions.com randomly changes the url to not include .jsp
         search_page_url = search_page_url.replace(".jsp", "")
-        page = urlopen(search_page_url)
+        page = _read_url(search_page_url)
+
+    return BeautifulSoup(page, "lxml")
+
+
+def _get_fights_from_search_page(search_page_url):
+    # List of (fight url, opponent name) entries to be returned
+    list_of_fights = []
 
     # Opening page
-    soup = BeautifulSoup(page.read(), "lxml")
+    soup = _open_search_page(search_page_url)
 
     # Getting the fighter column on the page
     fighter_column = soup.find('td', attrs={'width': '265px', 'valign': 'top', 'align': 'center'})
@@ -153,7 +780,7 @@ def _get_fights_from_search_page(search_page_url):
 
 
 def _get_fights_on_page(fighter_names):
-    # The list of fight urls on the current page
+    # The list of (fight url, opponent name) entries on the current page
     fights_on_page = []
 
     fighter_urls = fighter_names.find_all('a', href=True)
@@ -163,13 +790,254 @@ def _get_fights_on_page(fighter_names):
         if url['href'].startswith('fighter/'):
             clean_url = _sanitize_url(url['href'])
             logger.info(clean_url)
-            fights = _get_fights_from_fighter_page(clean_url)
+            add_known_names([_get_name_from_fighter_url(clean_url)])
+            fights = _get_fight_entries_from_fighter_page(clean_url)
             if fights is not None:
                 fights_on_page.extend(fights)
 
     return fights_on_page
 
 
+# Check if the input names an event card (ex. UFC 202) rather than a fight
+def is_event_query(input_text):
+    input_text = _normalize_query(input_text)
+    for word in cfg['versus_list']:
+        if word in input_text:
+            return False
+    for prefix in cfg['event_prefixes']:
+        if input_text.startswith(prefix + ' '):
+            return True
+    return False
+
+
+# Returns the fight info of every decision on an event card, in the order listed on the event page
+def get_event_fight_info(input_event):
+    query_key = _get_query_key(input_event)
+    if _is_known_miss(query_key):
+        logger.info('Query \'{}\' recently failed, skipping search.'.format(query_key[1]))
+        return None
+
+    try:
+        fight_urls = _singleflight(('event', query_key[1]), _get_event_fight_urls, query_key[1])
+    except (SiteUnavailableError, OSError):
+        logger.warning('mmadecisions.com is unavailable, looking for event {} in stored decisions...'
+                       .format(query_key[1]))
+        _refresh_corpus()
+        fight_urls = _get_decision_urls(corpus.find_event_rows(query_key[1]))
+        fight_info = [fight for fight in map(_get_fight, fight_urls) if fight is not None]
+        return fight_info or None
+
+    if not fight_urls:
+        logger.info('Unable to find event!')
+        _record_miss(query_key)
+        return None
+
+    # The decision pages are independent of each other, so fetch them all at once
+    fight_info = [fight for fight in _executor.map(_get_fight, fight_urls) if fight is not None]
+    return fight_info or None
+
+
+def _get_event_fight_urls(event_name):
+    url = _get_search_result_url(cfg['search_url'] + unidecode(event_name).replace(' ', '+'))
+    if url is None:
+        return None
+
+    # If page redirects to a search url, pick the matching event from the results
+    if cfg['search_sub_url'] in url:
+        logger.info('I\'m on a search page. Looking for event {}...'.format(event_name))
+        url = _get_event_url_from_search_page(url, event_name)
+        if url is None:
+            return None
+
+    if cfg['event_sub_url'] not in url:
+        logger.info('I\'m on an irrelevant page. Returning none...')
+        return None
+
+    logger.info('I\'m on an event page. Retrieving its decisions...')
+    soup = BeautifulSoup(_read_url(url), "lxml")
+    fight_urls = []
+    for link in soup.find_all('a', href=True):
+        if 'decision/' in link['href']:
+            clean_url = _sanitize_url(link['href'])
+            # Each fight is usually linked more than once on the event page
+            if clean_url not in fight_urls:
+                logger.info('\t\t' + clean_url)
+                fight_urls.append(clean_url)
+
+    return fight_urls
+
+
+def _get_event_url_from_search_page(search_page_url, event_name):
+    soup = _open_search_page(search_page_url)
+    event_urls = []
+    for link in soup.find_all('a', href=True):
+        if link['href'].startswith('event/'):
+            event_urls.append((_normalize_query(link.getText()), _sanitize_url(link['href'])))
+    if not event_urls:
+        return None
+
+    # Prefer an exact name match (ex. "UFC 202" shouldn't pick "UFC 202 Prelims" or "UFC 20")
+    for name, url in event_urls:
+        if name == event_name or name.startswith(event_name + ':'):
+            return url
+    for name, url in event_urls:
+        if name.startswith(event_name + ' '):
+            return url
+    return None
+
+
+# Check if the input asks for a fighter's career summary (ex. "fighter nate diaz"). Returns the fighter name if so.
+def get_fighter_name_from_input(input_text):
+    return _get_query_argument(input_text, cfg['fighter_query_prefix'])
+
+
+# Check if the input asks for a judge's scoring stats (ex. "judge derek cleary"). Returns the judge name if so.
+def get_judge_name_from_input(input_text):
+    return _get_query_argument(input_text, cfg['judge_query_prefix'])
+
+
+# Returns the rest of the input if it starts with the given query prefix
+def _get_query_argument(input_text, prefix):
+    input_text = input_text.strip()
+    if input_text.lower().startswith(prefix + ' '):
+        argument = input_text[len(prefix):].strip()
+        if len(argument) > 1:
+            return argument
+    return None
+
+
+# Decision record of a fighter: wins, losses and draws by decision type, most frequent judges and
+# the decisions the media disagreed with most. Returns None if the fighter can't be found.
+def get_fighter_summary(fighter):
+    try:
+        fighter_page_url = _singleflight(('fighter', _normalize_query(fighter)), _get_fighter_page_url, fighter)
+        if fighter_page_url is None:
+            return None
+
+        fight_urls = _singleflight(('fighter_page', fighter_page_url), _get_fights_from_fighter_page,
+                                   fighter_page_url)
+    except (SiteUnavailableError, OSError):
+        logger.warning('mmadecisions.com is unavailable, summarizing {} from stored decisions...'.format(fighter))
+        fight_info = [fight for fight in map(_get_fight, _get_stored_fight_urls([fighter])) if fight is not None]
+        if not fight_info:
+            return None
+        return _summarize_fights(fighter.title(), fight_info)
+
+    if not fight_urls:
+        return None
+
+    fight_info = [fight for fight in _executor.map(_get_fight, fight_urls) if fight is not None]
+    return _summarize_fights(_get_name_from_fighter_url(fighter_page_url), fight_info)
+
+
+def _get_fighter_page_url(fighter):
+    url = _get_search_result_url(cfg['search_url'] + unidecode(fighter).replace(' ', '+'))
+    if url is None:
+        return None
+    if cfg['fighter_sub_url'] in url:
+        return _sanitize_url(url)
+    if cfg['search_sub_url'] not in url:
+        return None
+
+    # Several fighters matched the search, so take the first one listed
+    soup = _open_search_page(url)
+    fighter_column = soup.find('td', attrs={'width': '265px', 'valign': 'top', 'align': 'center'})
+    if fighter_column is None:
+        return None
+    for link in fighter_column.find_all('a', href=True):
+        if link['href'].startswith('fighter/'):
+            return _sanitize_url(link['href'])
+    return None
+
+
+# Fighter urls end with the fighter's name, ex. fighter/1234/Conor-McGregor
+def _get_name_from_fighter_url(fighter_page_url):
+    return fighter_page_url.rstrip('/').split('/')[-1].replace('-', ' ')
+
+
+def _summarize_fights(fighter, fight_info):
+    fighter_words = set(_normalize_query(fighter).split())
+    # Ex. record['W']['split'] is the number of split decision wins
+    record = {'W': Counter(), 'L': Counter(), 'D': Counter()}
+    judges = Counter()
+    disagreements = []
+
+    for score_tables, fight_result, media_scores, event_info, fan_scores in fight_info:
+        result = _parse_fight_result(fight_result)
+        if result is None:
+            continue
+        winner, action, loser, decision = result
+
+        if 'drew' in action or 'draw' in decision:
+            outcome = 'D'
+        elif len(fighter_words & set(_normalize_query(winner).split())) >= \
+                len(fighter_words & set(_normalize_query(loser).split())):
+            outcome = 'W'
+        else:
+            outcome = 'L'
+        record[outcome][decision.split()[0]] += 1
+
+        for judge, table in score_tables:
+            judges[judge] += 1
+
+        # Media members that scored the fight differently than the judges' official result
+        if media_scores:
+            if outcome == 'D':
+                dissent = sum(1 for score in media_scores if score[1].upper() != 'DRAW')
+            else:
+                dissent = sum(1 for score in media_scores if score[1].upper() not in winner)
+            disagreements.append((dissent / len(media_scores), dissent, len(media_scores), fight_result))
+
+    disagreements.sort(key=lambda d: d[0], reverse=True)
+    return {
+        'fighter': fighter,
+        'num_fights': sum(sum(counts.values()) for counts in record.values()),
+        'record': record,
+        'judges': judges.most_common(cfg['fighter_summary_num_judges']),
+        'disagreements': [d[1:] for d in disagreements[:cfg['fighter_summary_num_disagreements']] if d[1] > 0],
+    }
+
+
+# Split a fight result like '[**A defeats B** (*split decision*)](url)' into (A, 'defeats', B, 'split decision')
+def _parse_fight_result(fight_result):
+    if fight_result is None:
+        return None
+    match = re.match(r'\[\*\*(.+?) ([a-z][a-z. ]*) ([^a-z]+)\*\* \(\*(.+)\*\)\]', fight_result.replace(u'\xa0', u' '))
+    if match is None:
+        return None
+    return match.group(1), match.group(2), match.group(3), match.group(4)
+
+
+# Check if the input asks for the biggest robberies (ex. "robberies" or "robberies ufc 202").
+# Returns (True, event name or None) if so.
+def get_robbery_query_from_input(input_text):
+    input_text = input_text.strip()
+    prefix = cfg['robbery_query_prefix']
+    if input_text.lower() == prefix:
+        return True, None
+    if input_text.lower().startswith(prefix + ' '):
+        return True, input_text[len(prefix):].strip()
+    return False, None
+
+
+# Decisions where the media disagreed most with the judges, answered from the local corpus without
+# fetching any pages. Returns a list of (fight result, dissenting media count, media count).
+def get_robberies(event_name=None):
+    _refresh_corpus()
+    if event_name:
+        robberies = corpus.event_disagreements(event_name, cfg['robbery_count'])
+    else:
+        robberies = corpus.biggest_robberies(cfg['robbery_count'], cfg['robbery_min_media'])
+    return [(corpus.get_string(corpus.result_ids[row]), dissent, total) for row, dissent, total in robberies]
+
+
+# How often a judge dissents from the other two judges and agrees with the media, answered from the
+# judge index of the local corpus without fetching any pages. Returns None if the judge isn't known.
+def get_judge_stats(judge):
+    _refresh_corpus()
+    return corpus.judge_stats(judge)
+
+
 def _get_fight_info_from_fight_page(fight_urls):
     if not fight_urls:
         return None
@@ -183,31 +1051,281 @@ def _get_fight_info_from_fight_page(fight_urls):
         if not url or home_url not in url:
             return None
 
-        # Opening the page
-        soup = BeautifulSoup(urlopen(url).read(), "lxml")
+        fight = _get_fight(url)
+        if fight is None:
+            return None
+
+        # Add a tuple containing all fight info
+        fight_info.append(fight)
+
+    return fight_info
+
 
-        # Getting all the information from the page
-        # This code is rough, just getting the backup attrs to work
+# Scorecards never change once posted, so a cached fight is served right away. Only the fan scores
+# keep changing, and those are refreshed in the background if they are stale.
+def _get_fight(url):
+    with _fight_cache_lock:
+        entry = _fight_cache.get(url)
+        if entry is not None:
+            _fight_cache.move_to_end(url)
+            fight = copy.deepcopy(entry[0])
+            # No point refreshing fan scores while the site is down. The refresh time is taken now, so summons
+            # arriving while the refresh is queued or running don't queue more of them.
+            refresh_fans = time.monotonic() - entry[1] > cfg['fan_score_refresh_interval'] and _breaker.is_closed()
+            if refresh_fans:
+                entry[1] = time.monotonic()
+
+    if entry is None:
         try:
-            score_tables = _get_score_tables(soup)
-            if not score_tables:
-                raise ValueError("could not get score tables")
-        except Exception:
-            logger.exception("unable to parse score table html, trying backup attrs")
-            score_tables = _get_score_tables(soup, use_backup_attrs=True)
-            if not score_tables:
-                return None
-        fight_result = _get_fight_result(soup, url)
-        event_info = _get_event_info(soup, url)
-        media_scores = _get_media_scores(soup, url)
-        if media_scores is None:
-            media_scores = _get_media_scores(soup, url, use_backup_attrs=True)
+            return _singleflight(('decision', url), _fetch_fight, url)
+        except (SiteUnavailableError, OSError):
+            # Remembered so the lookup isn't cached as a miss, whether or not the decision is stored
+            _lookup_state.site_failed = True
+            fight = _get_stored_fight(url)
+            if fight is None:
+                logger.warning('Could not fetch decision page {} and it isn\'t stored'.format(url))
+            return fight
+
+    if refresh_fans:
+        _executor.submit(_refresh_cached_fan_scores, url)
+    return fight
+
+
+# A decision from the local corpus, for when its page can't be fetched. Stored fan scores may be out of date.
+def _get_stored_fight(url):
+    _refresh_corpus()
+    fight = corpus.get_fight(url)
+    if fight is not None:
+        logger.info('Serving stored decision for url {}'.format(url))
+        metrics['stored_answers'] += 1
+    return fight
+
+
+# Urls of stored decisions whose result names all the given fighters, for when the site can't be searched
+def _get_stored_fight_urls(fighters):
+    _refresh_corpus()
+    return _get_decision_urls(corpus.find_fight_rows(fighters))
+
+
+def _get_decision_urls(rows):
+    return [home_url + 'decision/{}/fight'.format(corpus.decision_ids[row]) for row in rows]
+
+
+def _fetch_fight(url):
+    fight = _parse_fight_page(url)
+    if fight is not None:
+        _cache_fight(url, fight)
+        # Pages read without their fan score chart get their fan scores in the background
+        if fight[4] is None and not cfg['decision_page_fan_scores']:
+            _executor.submit(_refresh_cached_fan_scores, url)
+        if corpus_writer:
+            corpus.add_fight(url, fight)
+            _mark_corpus_dirty()
+        result = _parse_fight_result(fight[1])
+        if result is not None:
+            add_known_names([result[0], result[2]])
+    return fight
+
+
+# Other processes pick up the writer's latest corpus file when it changes
+def _refresh_corpus():
+    global corpus
+    if corpus_writer:
+        return
+    try:
+        mtime = os.stat(cfg['corpus_file']).st_mtime
+    except FileNotFoundError:
+        return
+    if mtime != corpus.mtime:
+        logger.info('Corpus file changed, reopening it...')
+        corpus = decision_corpus.open_corpus(cfg['corpus_file'])
+
+
+def _mark_corpus_dirty():
+    global _corpus_dirty
+    _corpus_dirty = True
+
+
+# Make this process the corpus writer. Unsaved changes are saved every corpus_save_interval seconds, and once
+# more when the process exits.
+def start_corpus_writer():
+    global corpus_writer
+    corpus_writer = True
+    threading.Thread(target=_run_corpus_saver, name='corpus_saver', daemon=True).start()
+    atexit.register(save_corpus)
+
+
+def _run_corpus_saver():
+    while True:
+        time.sleep(cfg['corpus_save_interval'])
+        save_corpus()
+
+
+def save_corpus():
+    global _corpus_dirty
+    with _corpus_save_lock:
+        if not _corpus_dirty:
+            return
+        # Cleared first, so changes made while saving are saved next time
+        _corpus_dirty = False
+        try:
+            corpus.save(cfg['corpus_file'])
+        except OSError:
+            _corpus_dirty = True
+            logger.exception('Could not save corpus file \'{}\''.format(cfg['corpus_file']))
+
+
+def _cache_fight(url, fight):
+    with _fight_cache_lock:
+        _fight_cache[url] = [copy.deepcopy(fight), time.monotonic()]
+        _fight_cache.move_to_end(url)
+        while len(_fight_cache) > cfg['fight_cache_size']:
+            _fight_cache.popitem(last=False)
+
+
+def _refresh_cached_fan_scores(url):
+    try:
+        fan_scores = _singleflight(('fans', url), refresh_fan_scores, url)
+    except SiteUnavailableError:
+        logger.info('Skipping fan score refresh for url {}, mmadecisions.com is unavailable'.format(url))
+        return
+    except Exception:
+        logger.exception('Could not refresh fan scores from url {}'.format(url))
+        return
+
+    with _fight_cache_lock:
+        entry = _fight_cache.get(url)
+        if entry is None:
+            return
+        # Keep the last known fan scores if the refresh didn't find any
+        if fan_scores is not None:
+            entry[0] = entry[0][:4] + (fan_scores,)
+        entry[1] = time.monotonic()
+    if fan_scores is not None and corpus_writer:
+        corpus.update_fan_scores(url, fan_scores)
+        _mark_corpus_dirty()
+
+
+# Fetch a decision page and pull out only the fan scores, without building a soup of the whole page. The page
+# is read in chunks like _read_decision_page(), and the connection is closed once the fan score array has ended.
+def refresh_fan_scores(url: str) -> Optional[List[List[Union[str, int]]]]:
+    html = b''
+    page = _open_url(url)
+    try:
+        chunk = page.read(cfg['fetch_chunk_size'])
+        while chunk:
+            html += chunk
+            score_array = _find_fan_score_array(html)
+            if score_array is not None:
+                logger.info('Found fan scores of {} after {} bytes, closing connection'.format(url, len(html)))
+                return score_array
+            chunk = page.read(cfg['fetch_chunk_size'])
+    except OSError:
+        _breaker.record_failure()
+        raise
+    finally:
+        page.close()
+    logger.error("Could not find fan scores for some reason from url {}".format(url))
+    return None
+
+
+def _find_fan_score_array(html: bytes) -> Optional[List[List[Union[str, int]]]]:
+    add_rows_string = b'data.addRows(['
+    start_index = html.find(add_rows_string)
+    # Other charts on the page may use addRows as well. The fan score array is the one with 3 rows.
+    while start_index != -1:
+        end_index = html.find(b']);', start_index, start_index+500)
+        if end_index == -1:
+            break
+        data_array_string = html[start_index+len(add_rows_string):end_index].decode('utf-8', 'replace').strip()
+        try:
+            score_array = _parse_fan_score_array(data_array_string)
+            if len(score_array) == 3:
+                return score_array
+        except ValueError:
+            pass
+        start_index = html.find(add_rows_string, end_index)
+    return None
+
+
+# Read a decision page only as far as it's needed. The page is fed to an incremental lxml parser as it
+# arrives, and the connection is closed once the media scores table (which comes after the scorecards,
+# result and event info) and, if decision_page_fan_scores is set, the fan score chart script have ended.
+# The parser only finds where the sections end and which layout their tables are in; the bytes read so far
+# are parsed with BeautifulSoup as usual. Returns the bytes and the layout fingerprint, ex. {'media': 'backup'}.
+def _read_decision_page(url: str) -> Tuple[bytes, Dict[str, str]]:
+    parser = etree.HTMLPullParser(events=('end',), tag=('table', 'script'))
+    chunks = []
+    fingerprint = {}
+    found_fans = not cfg['decision_page_fan_scores']
+
+    page = _open_url(url)
+    try:
+        chunk = page.read(cfg['fetch_chunk_size'])
+        while chunk:
+            chunks.append(chunk)
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if element.tag == 'table':
+                    for section, layout, attrs in _TABLE_LAYOUTS:
+                        # A primary layout table anywhere on the page outweighs a lookalike backup one
+                        if _has_attrs(element, attrs) and fingerprint.get(section) != LAYOUT_PRIMARY:
+                            fingerprint[section] = layout
+                elif not found_fans and element.text and 'data.addRows([' in element.text:
+                    found_fans = _find_fan_score_array(element.text.encode('utf-8')) is not None
+                # Nothing else is needed from parsed elements, so don't keep them around
+                element.clear()
+            if 'media' in fingerprint and found_fans:
+                logger.info('Found all sections of {} after {} bytes, closing connection'
+                            .format(url, sum(len(c) for c in chunks)))
+                break
+            chunk = page.read(cfg['fetch_chunk_size'])
+    except OSError:
+        _breaker.record_failure()
+        raise
+    finally:
+        page.close()
+    return b''.join(chunks), fingerprint
+
+
+def _has_attrs(element, attrs):
+    return all(element.get(name) == value for name, value in attrs.items())
+
+
+def _parse_fight_page(url):
+    # Opening the page
+    html, fingerprint = _read_decision_page(url)
+    soup = BeautifulSoup(html, "lxml")
+    layout = _get_page_layout(fingerprint, url)
+
+    # Getting all the information from the page, with the attrs of the layout it's in
+    score_tables = _get_score_tables(soup, use_backup_attrs=layout['score_tables'] == LAYOUT_BACKUP)
+    if not score_tables:
+        logger.error('Could not get score tables ({} layout) from url {}'.format(layout['score_tables'], url))
+        return None
+    fight_result = _get_fight_result(soup, url)
+    event_info = _get_event_info(soup, url)
+    media_scores = _get_media_scores(soup, url, use_backup_attrs=layout['media'] == LAYOUT_BACKUP)
+    fan_scores = None
+    if cfg['decision_page_fan_scores']:
         fan_scores = _get_fan_scores(soup, url)
 
-        # Add a tuple containing all fight info
-        fight_info.append((score_tables, fight_result, media_scores, event_info, fan_scores))
+    return score_tables, fight_result, media_scores, event_info, fan_scores
 
-    return fight_info
+
+# Layout to parse a page with: its own fingerprint where it has one, otherwise the layout the site is
+# currently serving. A fingerprint that differs from the current layout means the site switched layouts.
+def _get_page_layout(fingerprint, url):
+    with _site_layout_lock:
+        for section, layout in fingerprint.items():
+            if _site_layout[section] != layout:
+                logger.warning('mmadecisions.com switched {} layout from {} to {} (url {})'
+                               .format(section, _site_layout[section], layout, url))
+                metrics['layout_switches'] += 1
+                _layout_switches.append({'section': section, 'old_layout': _site_layout[section],
+                                         'new_layout': layout, 'url': url})
+                _site_layout[section] = layout
+        return dict(_site_layout)
 
 
 def _get_fan_scores(soup, url: str) -> Optional[List[List[Union[str, int]]]]:
@@ -233,14 +1351,7 @@ def _get_fan_scores(soup, url: str) -> Optional[List[List[Union[str, int]]]]:
 
         data_array_string = fan_script[start_index+len(add_rows_string):end_index].strip()
         del fan_script
-        # Valid JSON needs to use "" for strings. Javascript can use '', which is what we have right now
-        data_array_string = data_array_string.replace("['", "[\"").replace("',", "\",")
-        # Need to make it a list of lists
-        data_array_string = f"[ {data_array_string} ]"
-
-        json_string = f"{{ \"data\": {data_array_string} }}"
-        data_dict = json.loads(json_string)
-        score_array = data_dict["data"]
+        score_array = _parse_fan_score_array(data_array_string)
 
         if len(score_array) != 3:
             logger.error("Score array was not length of 3 for some reason, error parsing. {}".format(score_array))
@@ -253,6 +1364,18 @@ def _get_fan_scores(soup, url: str) -> Optional[List[List[Union[str, int]]]]:
         return None
 
 
+# Convert the rows of a javascript data.addRows() call into a list of lists
+def _parse_fan_score_array(data_array_string):
+    # Valid JSON needs to use "" for strings. Javascript can use '', which is what we have right now
+    data_array_string = data_array_string.replace("['", "[\"").replace("',", "\",")
+    # Need to make it a list of lists
+    data_array_string = f"[ {data_array_string} ]"
+
+    json_string = f"{{ \"data\": {data_array_string} }}"
+    data_dict = json.loads(json_string)
+    return data_dict["data"]
+
+
 # Getting the score tables from the fight page
 def _get_score_tables(soup, use_backup_attrs=False):
     # The final tables to be returned: list of (judge name, table rows) tuples
@@ -261,9 +1384,9 @@ def _get_score_tables(soup, use_backup_attrs=False):
     # Finding the decision scores table on the page
     if use_backup_attrs:
         # Sometimes mmadecisions.com changes their html
-        html_tables = soup.find_all('table', limit=3, attrs={'cellspacing': '1', 'width': '100%'})
+        html_tables = soup.find_all('table', limit=3, attrs=_BACKUP_SCORE_TABLE_ATTRS)
     else:
-        html_tables = soup.find_all('table', limit=3, attrs={'style': 'border-spacing: 1px; width: 100%'})
+        html_tables = soup.find_all('table', limit=3, attrs=_SCORE_TABLE_ATTRS)
     if not html_tables:
         return None
 
@@ -356,9 +1479,9 @@ def _get_event_info(soup, url):
 def _get_media_scores(soup, url, use_backup_attrs=False):
     try:
         if use_backup_attrs:
-            media_section = soup.find('table', attrs={'cellspacing': '2', 'width': '100%'})
+            media_section = soup.find('table', attrs=_BACKUP_MEDIA_TABLE_ATTRS)
         else:
-            media_section = soup.find('table', attrs={'style': 'border-spacing: 0px; width: 100%'})
+            media_section = soup.find('table', attrs=_MEDIA_TABLE_ATTRS)
         if not media_section:
             raise ValueError("could not find media section attributes in html")
 
@@ -392,7 +1515,7 @@ def _get_full_date(num_date, url):
 
 def _sanitize_url(url):
     # Check if the url is a valid url
-    if 'decision/' not in url and 'fighter/' not in url:
+    if 'decision/' not in url and 'fighter/' not in url and 'event/' not in url:
         return None
 
     if url.startswith('decision/'):
@@ -402,7 +1525,7 @@ def _sanitize_url(url):
         url = home_url + url
 
     # Add home_url to the front of the url if needed
-    elif url.startswith('fighter/'):
+    elif url.startswith('fighter/') or url.startswith('event/'):
         url = home_url + url
 
     # Remove the jsessionid from the url
@@ -453,6 +1576,71 @@ def get_fighters_from_input(input_fight):
     return None, None, -1
 
 
+# Add fighter names (ex. "Conor McGregor") to the local name dictionary
+def add_known_names(names):
+    for name in names:
+        name = _normalize_query(name)
+        if name:
+            _known_full_names.add(name)
+            _known_name_fragments.update(word for word in name.split() if len(word) > 1)
+
+
+# Add parts of fighter names (ex. "Conor" or "McGregor") without taking them for full names
+def add_known_name_fragments(names):
+    for name in names:
+        _known_name_fragments.update(word for word in _normalize_query(name).split() if len(word) > 1)
+
+
+def _load_known_names():
+    global _known_names_loaded
+    _known_names_loaded = True
+    names = []
+    for string_ids in (corpus.fighter_ids[:corpus.size].ravel(), corpus.result_ids[:corpus.size]):
+        for string_id in set(string_ids.tolist()):
+            string = corpus.get_string(string_id)
+            result = _parse_fight_result(string)
+            if result is not None:
+                names.extend((result[0], result[2]))
+            elif string is not None:
+                names.append(string)
+    add_known_names(names)
+
+
+# How much a string looks like a fighter name: the share of its words that are known name fragments,
+# plus one if it's a known full name
+def _score_name(name):
+    words = name.split()
+    if not words:
+        return 0
+    score = sum(1 for word in words if word in _known_name_fragments) / len(words)
+    if name in _known_full_names:
+        score += 1
+    return score
+
+
+# Order guessed (fighter 1, fighter 2) splits best first: by how many sides are known full names, then by
+# name scores. Splits are only dropped when a split naming two known fighters beats them, since an unknown
+# side can still be a fighter the bot hasn't seen yet.
+def _rank_name_combos(name_combos):
+    if not _known_names_loaded:
+        _load_known_names()
+
+    scored_combos = []
+    for combo in name_combos:
+        name_1, name_2 = _normalize_query(combo[0]), _normalize_query(combo[1])
+        score_1, score_2 = _score_name(name_1), _score_name(name_2)
+        full_names = (name_1 in _known_full_names) + (name_2 in _known_full_names)
+        scored_combos.append(((full_names, min(score_1, score_2), score_1 + score_2), combo))
+
+    known_keys = [key for key, combo in scored_combos if key[0] == 2]
+    if known_keys:
+        scored_combos = [scored for scored in scored_combos if scored[0] >= max(known_keys)]
+    # Sorting is stable, so equally likely splits keep their original order
+    scored_combos.sort(key=lambda scored: scored[0], reverse=True)
+    logger.info('Ranked name splits: {}'.format([scored[1] for scored in scored_combos]))
+    return [scored[1] for scored in scored_combos]
+
+
 # Used when variations of "versus" are not found in the input
 def _guess_fighters_from_input(input_fight):
     input_fight = input_fight.strip()
@@ -490,10 +1678,16 @@ def get_fight_info_from_input(input_fight):
     # Try getting fighter names by looking for variations of "vs"
     fighter_1, fighter_2, fight_num = get_fighters_from_input(input_fight)
     fight_info = None
+    query_key = _get_query_key(input_fight)
+    _lookup_state.site_failed = False
 
     # Input is blank
     if input_fight.strip() == '':
         logger.info('\nInput fight is blank! Please try again.')
+    # Same query recently came up empty, so don't search the whole site again
+    elif _is_known_miss(query_key):
+        logger.info('Query \'{}\' recently failed, skipping search.'.format(query_key[1]))
+        return None, fight_num
     # One or both of the fighter names is whitespace
     elif fighter_1 == '' or fighter_2 == '':
         logger.info('\nOne or both of the fighter names is blank! Please try again.')
@@ -506,6 +1700,8 @@ def get_fight_info_from_input(input_fight):
     else:
         logger.info('No \'versus\' found in input, so guessing fighters...\n')
         name_combos, fight_num = _guess_fighters_from_input(input_fight)
+        # Try the splits that look most like real fighter names first, and skip the ones that can't be
+        name_combos = _rank_name_combos(name_combos)
         for combo in name_combos:
             logger.info('Trying fighter 1: ' + combo[0])
             logger.info('Trying fighter 2: ' + combo[1] + '\n')
@@ -519,6 +1715,9 @@ def get_fight_info_from_input(input_fight):
 
     if not fight_info:
         logger.info('Unable to find fight!')
+        # A miss while the site is down may just be a fight that isn't stored locally
+        if input_fight.strip() != '' and not _lookup_state.site_failed:
+            _record_miss(query_key)
     else:
         logger.info('Fight found!')
 
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger('STRUCTURED_LOG')
+
+
+# Append-only log written by a background thread, so logging never blocks the caller on file I/O.
+# Lines are queued, written in batches, and the file is rotated (log.jsonl -> log.jsonl.1 -> ...) once it
+# grows past max_bytes. A max_bytes of None disables rotation.
+class StructuredLog:
+    def __init__(self, path, max_bytes=None, backup_count=3, flush_interval=1.0, batch_size=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='structured_log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # Log a record as a single JSON line, with the current time added
+    def log(self, event, **fields):
+        record = {'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'event': event}
+        record.update(fields)
+        self.write_line(json.dumps(record, ensure_ascii=False, default=str))
+
+    def write_line(self, line):
+        self._queue.put(line)
+
+    # Write out everything queued so far and stop the writer thread
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch = []
+            try:
+                line = self._queue.get(timeout=self.flush_interval)
+                while line is not None:
+                    batch.append(line)
+                    if len(batch) >= self.batch_size:
+                        break
+                    line = self._queue.get_nowait()
+                closed = line is None
+            except queue.Empty:
+                pass
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        try:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(batch) + '\n')
+                size = f.tell()
+            if self.max_bytes is not None and size >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            logger.exception('Could not write to \'{}\''.format(self.path))
+            sys.stdout.write('\n'.join(batch) + '\n')
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self.path, i)):
+                os.replace('{}.{}'.format(self.path, i), '{}.{}'.format(self.path, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)